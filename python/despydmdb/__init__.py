@@ -3,3 +3,19 @@
 """
 __version__ = '0.1.2'
 version = __version__
+
+# names importable from the package, their modules are only imported on first use
+# so e.g. despydmdb.load_config doesn't pull in the DB modules
+_LAZY_NAMES = {'DesDmDbi': 'despydmdb.desdmdbi',
+               'DBSemaphore': 'despydmdb.dbsemaphore',
+               'JobFileMvmtResolver': 'despydmdb.jobfilemvmt',
+               'ArchiveRouter': 'despydmdb.archiveroute',
+               'TaskTree': 'despydmdb.tasktree',
+               'load_config': 'despydmdb.configcache'}
+
+
+def __getattr__(name):
+    if name in _LAZY_NAMES:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
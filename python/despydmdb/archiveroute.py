@@ -0,0 +1,117 @@
+"""
+    Precomputed multi-hop routing between archives built from the archive transfer
+    info (ops_archive_transfer and ops_archive_transfer_val tables)
+"""
+
+import math
+
+import despymisc.miscutils as miscutils
+
+# optional ops_archive_transfer_val key giving the cost of a direct transfer, default 1
+COST_KEY = 'cost'
+DEFAULT_COST = 1.0
+
+
+class ArchiveRouter:
+    """ All-pairs table of the cheapest transfer routes between archives
+
+        Routes are computed once (Floyd-Warshall over the direct transfers) so each
+        lookup is a single dictionary access.
+
+        Parameters
+        ----------
+        transfer_info : dict
+            [src][dst] = {'transfer': transfer class, key: val, ...} as returned by
+            DesDmDbi.get_archive_transfer_info.  Entries without a transfer class are
+            ignored.
+    """
+
+    def __init__(self, transfer_info):
+        direct = {}
+        for (src, dsts) in transfer_info.items():
+            for (dst, info) in dsts.items():
+                if info.get('transfer') is None:
+                    miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: no transfer class for {src} -> {dst}, skipping")
+                    continue
+                try:
+                    cost = float(info.get(COST_KEY, DEFAULT_COST))
+                except ValueError:
+                    cost = None
+                # negative costs would make the cheapest routes ill defined
+                if cost is None or not math.isfinite(cost) or cost < 0:
+                    raise ValueError(f"Invalid {COST_KEY} ({info[COST_KEY]}) for archive transfer {src} -> {dst}")
+                direct[(src, dst)] = (cost, info['transfer'])
+
+        archives = sorted({arch for pair in direct for arch in pair})
+        dist = {}
+        nexthop = {}
+        for ((src, dst), (cost, _)) in direct.items():
+            if src != dst:
+                dist[(src, dst)] = cost
+                nexthop[(src, dst)] = dst
+
+        for mid in archives:
+            for src in archives:
+                if (src, mid) not in dist:
+                    continue
+                for dst in archives:
+                    if src == dst or (mid, dst) not in dist:
+                        continue
+                    cost = dist[(src, mid)] + dist[(mid, dst)]
+                    if cost < dist.get((src, dst), float('inf')):
+                        dist[(src, dst)] = cost
+                        nexthop[(src, dst)] = nexthop[(src, mid)]
+
+        self.archives = archives
+        self._routes = {}
+        for (src, dst) in dist:
+            path = [src]
+            while path[-1] != dst:
+                path.append(nexthop[(path[-1], dst)])
+            transfers = [direct[(path[i], path[i+1])][1] for i in range(len(path) - 1)]
+            self._routes[(src, dst)] = {'path': path, 'transfers': transfers, 'cost': dist[(src, dst)]}
+
+        # transfers within an archive are always direct
+        for ((src, dst), (cost, transfer)) in direct.items():
+            if src == dst:
+                self._routes[(src, dst)] = {'path': [src, dst], 'transfers': [transfer], 'cost': cost}
+
+    def route(self, src, dst):
+        """ Return the cheapest route from one archive to another
+
+            Parameters
+            ----------
+            src : str
+                The name of the source archive
+
+            dst : str
+                The name of the destination archive
+
+            Returns
+            -------
+            dict
+                Dictionary with the keys 'path' (list of archive names from src to dst),
+                'transfers' (list of the transfer class of each hop) and 'cost' (total cost).
+                It should be treated as read-only.
+        """
+        try:
+            return self._routes[(src, dst)]
+        except KeyError:
+            raise ValueError(f"No archive transfer route from {src} to {dst}")
+
+    def has_route(self, src, dst):
+        """ Return whether there is a route from one archive to another
+
+            Parameters
+            ----------
+            src : str
+                The name of the source archive
+
+            dst : str
+                The name of the destination archive
+
+            Returns
+            -------
+            bool
+        """
+        return (src, dst) in self._routes
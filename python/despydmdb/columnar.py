@@ -0,0 +1,188 @@
+"""
+    Convert batches of query result rows into columns (numpy arrays or arrow
+    record batches)
+
+    The type of each column is decided once per query from the cursor description
+    (see description_kinds), so every batch of a query has the same types.
+"""
+
+# column kinds and their numpy and arrow types (the arrow type names are pyarrow functions)
+KIND_TYPES = {'int': ('int64', 'int64'),
+              'float': ('float64', 'float64'),
+              'str': (object, 'string'),
+              'datetime': ('datetime64[us]', None),
+              'binary': (object, 'binary'),
+              'object': (object, None)}
+
+# description type names (without the DB_TYPE_ prefix of newer drivers) and their kinds,
+# NUMBER is decided by its precision and scale
+TYPE_KINDS = {'BINARY_DOUBLE': 'float', 'BINARY_FLOAT': 'float', 'NATIVE_FLOAT': 'float',
+              'BINARY_INTEGER': 'int', 'NATIVE_INT': 'int',
+              'CHAR': 'str', 'NCHAR': 'str', 'VARCHAR': 'str', 'NVARCHAR': 'str', 'STRING': 'str',
+              'FIXED_CHAR': 'str', 'FIXED_NCHAR': 'str', 'LONG': 'str', 'LONG_STRING': 'str', 'ROWID': 'str',
+              'DATE': 'datetime', 'DATETIME': 'datetime', 'TIMESTAMP': 'datetime',
+              'TIMESTAMP_TZ': 'datetime', 'TIMESTAMP_LTZ': 'datetime',
+              'RAW': 'binary', 'LONG_RAW': 'binary', 'BINARY': 'binary', 'LONG_BINARY': 'binary'}
+
+
+def description_kinds(description, overrides=None):
+    """ Return the kind of each column of a query from the cursor description
+
+        NUMBER columns with precision and scale 0 are 'int', other NUMBER columns
+        'float'.  Columns of unknown type (e.g. drivers not reporting types) are 'object'.
+
+        Parameters
+        ----------
+        description : list
+            The cursor description
+
+        overrides : dict, optional
+            Kinds of some columns (lower case column name as key) replacing the ones
+            from the description, default is None
+
+        Returns
+        -------
+        list
+            The kinds (keys of KIND_TYPES)
+    """
+    kinds = []
+    for desc in description:
+        name = desc[0].lower()
+        if overrides and name in overrides:
+            kind = overrides[name]
+            if kind not in KIND_TYPES:
+                raise ValueError(f"Invalid column kind ({kind}) for column {name}")
+        else:
+            kind = _column_kind(desc)
+        kinds.append(kind)
+    return kinds
+
+
+def _column_kind(desc):
+    """ Return the kind of a column from its cursor description entry """
+    typename = getattr(desc[1], 'name', None) or getattr(desc[1], '__name__', None)
+    if not isinstance(typename, str):
+        return 'object'
+    typename = typename.upper()
+    if typename.startswith('DB_TYPE_'):
+        typename = typename[len('DB_TYPE_'):]
+    if typename == 'NUMBER':
+        (precision, scale) = desc[4:6]
+        return 'int' if precision and scale == 0 else 'float'
+    return TYPE_KINDS.get(typename, 'object')
+
+
+def _int_values(name, values):
+    """ Convert the values of an int column into an int64 array and a mask of
+        the NULLs, raising ValueError instead of truncating non-integer values
+    """
+    import numpy
+
+    mask = numpy.fromiter((val is None for val in values), dtype=bool, count=len(values))
+    data = numpy.array([0 if val is None else val for val in values] if mask.any() else values)
+    if data.dtype.kind == 'f':
+        if not numpy.all(numpy.isfinite(data)) or numpy.any(data != numpy.floor(data)):
+            raise ValueError(f"Column {name} has non-integer values")
+    elif data.dtype.kind not in 'iu' and len(values) > 0:
+        raise ValueError(f"Column {name} has values which are not 64 bit integers")
+    return data.astype('int64'), mask
+
+
+def to_numpy_columns(names, kinds, rows):
+    """ Convert result rows into one numpy array per column
+
+        int columns become masked int64 arrays (masked where NULL), float columns
+        float64 with NaN for NULL, datetime columns datetime64[us] with NaT for NULL.
+        Other columns are object arrays.
+
+        Parameters
+        ----------
+        names : list
+            The column names
+
+        kinds : list
+            The kind of each column (see description_kinds)
+
+        rows : list
+            The result rows (tuples)
+
+        Returns
+        -------
+        collections.OrderedDict
+            Dictionary with the column names as keys and numpy arrays as values
+    """
+    import collections
+    import numpy
+
+    columns = collections.OrderedDict()
+    allvalues = list(zip(*rows)) if rows else [()] * len(names)
+    for (name, kind, values) in zip(names, kinds, allvalues):
+        if kind == 'int':
+            (data, mask) = _int_values(name, values)
+            arr = numpy.ma.masked_array(data, mask=mask)
+        elif kind == 'float':
+            arr = numpy.array([numpy.nan if val is None else val for val in values], dtype=numpy.float64)
+        elif kind == 'datetime':
+            arr = numpy.array(values, dtype=KIND_TYPES[kind][0])
+        else:
+            arr = numpy.empty(len(values), dtype=object)
+            arr[:] = values
+        columns[name] = arr
+    return columns
+
+
+def arrow_schema(names, kinds):
+    """ Return the arrow schema of a query
+
+        Parameters
+        ----------
+        names : list
+            The column names
+
+        kinds : list
+            The kind of each column (see description_kinds)
+
+        Returns
+        -------
+        pyarrow.Schema
+    """
+    import pyarrow
+
+    fields = []
+    for (name, kind) in zip(names, kinds):
+        if kind == 'datetime':
+            atype = pyarrow.timestamp('us')
+        elif KIND_TYPES[kind][1] is None:
+            raise ValueError(f"No arrow type for column {name} of kind {kind}, give its kind explicitly")
+        else:
+            atype = getattr(pyarrow, KIND_TYPES[kind][1])()
+        fields.append(pyarrow.field(name, atype))
+    return pyarrow.schema(fields)
+
+
+def to_arrow_batch(schema, rows):
+    """ Convert result rows into an arrow record batch, NULLs become arrow nulls
+
+        Parameters
+        ----------
+        schema : pyarrow.Schema
+            The schema of the query (see arrow_schema)
+
+        rows : list
+            The result rows (tuples)
+
+        Returns
+        -------
+        pyarrow.RecordBatch
+    """
+    import pyarrow
+
+    arrays = []
+    allvalues = list(zip(*rows)) if rows else [()] * len(schema)
+    for (field, values) in zip(schema, allvalues):
+        if pyarrow.types.is_integer(field.type):
+            (data, mask) = _int_values(field.name, values)
+            arrays.append(pyarrow.array(data, type=field.type, mask=mask))
+        else:
+            arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
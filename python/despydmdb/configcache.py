@@ -0,0 +1,56 @@
+"""
+    File copy of the configuration cached by DesDmDbi (see DesDmDbi.get_config and
+    DesDmDbi.dump_config), so short-lived jobs can use it without importing the DB
+    modules or connecting to the database
+"""
+
+import collections
+import json
+import os
+
+
+def save_config(path, config):
+    """ Write configuration to a file, replacing it atomically so jobs reading
+        the file never see a partial copy
+
+        Parameters
+        ----------
+        path : str
+            The name of the file
+
+        config : dict
+            Dictionary with the configuration names (e.g. 'site_info') as keys and
+            the values returned by DesDmDbi.get_config as values
+    """
+    tmppath = f"{path}.{os.getpid()}.tmp"
+    with open(tmppath, 'w') as fh:
+        json.dump(config, fh)
+    os.replace(tmppath, path)
+
+
+def load_config(path, names=None):
+    """ Read configuration written by save_config
+
+        Parameters
+        ----------
+        path : str
+            The name of the file
+
+        names : list, optional
+            The configuration names to return, default is None (all in the file)
+
+        Returns
+        -------
+        dict
+            Dictionary with the configuration names as keys, the nested dictionaries
+            are OrderedDicts like those returned by DesDmDbi
+    """
+    with open(path, 'r') as fh:
+        config = json.load(fh, object_pairs_hook=collections.OrderedDict)
+    if names is None:
+        return config
+
+    missing = [name for name in names if name not in config]
+    if missing:
+        raise ValueError(f"Missing configuration {', '.join(missing)} in {path}")
+    return collections.OrderedDict((name, config[name]) for name in names)
@@ -0,0 +1,178 @@
+"""
+    Parallel, streaming ingestion of datafiles (e.g. fits catalogs) into the target
+    table given by DesDmDbi.get_datafile_metadata
+"""
+
+import os
+
+import despymisc.miscutils as miscutils
+import despydmdb.datafilemap as datafilemap
+import despydmdb.sessionpool as sessionpool
+
+DEFAULT_CHUNKSIZE = 50000
+
+# per worker process state, set by _init_ingest_worker
+_MAPPER = None
+_READER = None
+_CHUNKSIZE = None
+_FILENAME_COLUMN = None
+
+
+def read_fits_chunks(filename, hdu, chunksize):
+    """ Read a fits binary table in chunks of rows
+
+        Parameters
+        ----------
+        filename : str
+            The name of the fits file
+
+        hdu : str
+            The name of the hdu containing the table
+
+        chunksize : int
+            The maximum number of rows per chunk
+
+        Yields
+        ------
+        numpy structured array
+    """
+    import fitsio
+
+    with fitsio.FITS(filename) as fits:
+        table = fits[hdu]
+        nrows = table.get_nrows()
+        for start in range(0, nrows, chunksize):
+            yield table[start:start + chunksize]
+
+
+def _init_ingest_worker(desfile, section, datafile_metadata, hdu, reader, chunksize, filename_column):
+    """ Pool initializer, opens the DB session and compiles the row mapper once per worker
+    """
+    global _MAPPER, _READER, _CHUNKSIZE, _FILENAME_COLUMN  #pylint: disable=global-statement
+    sessionpool.init_worker(desfile, section)
+    _MAPPER = datafilemap.DatafileRowMapper(datafile_metadata, hdu)
+    _READER = reader
+    _CHUNKSIZE = chunksize
+    _FILENAME_COLUMN = filename_column
+
+
+def _ingest_file(filename):
+    """ Stream one datafile into the target table and commit it
+
+        Returns
+        -------
+        tuple
+            (filename, number of rows or None on failure, error message or None)
+    """
+    dbh = sessionpool.worker_dbh()
+    extra = None
+    if _FILENAME_COLUMN is not None:
+        extra = {_FILENAME_COLUMN: os.path.basename(filename)}
+
+    nrows = 0
+    try:
+        for chunk in _READER(filename, _MAPPER.hdu, _CHUNKSIZE):
+            nrows += _MAPPER.insert(dbh, chunk, _CHUNKSIZE, extra)
+        dbh.commit()
+    except Exception as err:
+        dbh.rollback()
+        miscutils.fwdebug(0, 'DESDBI_DEBUG', f"ERROR: ingesting {filename}: {err}")
+        return (filename, None, str(err))
+    return (filename, nrows, None)
+
+
+class DatafileIngestPipeline:
+    """ Ingest datafiles of one filetype using a pool of worker processes
+
+        Each worker has its own DB session and streams its files in chunks of rows,
+        so memory per worker is bounded by the chunk size.  Each file is committed
+        separately.
+
+        Parameters
+        ----------
+        desfile : str
+            The name of the services file to use.
+
+        section : str
+            The name of the section in the services file to use.
+
+        filetype : str
+            The filetype of the datafiles
+
+        hdu : str
+            The name of the hdu containing the table data
+
+        nworkers : int, optional
+            The number of worker processes. Default is None (the number of cores).
+
+        chunksize : int, optional
+            The number of rows read and inserted at a time. Default is DEFAULT_CHUNKSIZE.
+
+        reader : callable, optional
+            Module level function (filename, hdu, chunksize) yielding numpy structured
+            arrays. Default is read_fits_chunks.
+
+        filename_column : str, optional
+            Name of a target column to fill with the name of the datafile. Default is None.
+
+        datafile_metadata : list, optional
+            [target_table_name, metadata] as returned by DesDmDbi.get_datafile_metadata,
+            default is None (queried from the database).
+    """
+
+    def __init__(self, desfile, section, filetype, hdu, nworkers=None, chunksize=DEFAULT_CHUNKSIZE,
+                 reader=read_fits_chunks, filename_column=None, datafile_metadata=None):
+        self.desfile = desfile
+        self.section = section
+        self.filetype = filetype
+        self.hdu = hdu
+        self.nworkers = nworkers
+        self.chunksize = chunksize
+        self.reader = reader
+        self.filename_column = filename_column
+        self.datafile_metadata = datafile_metadata
+
+    def run(self, filelist, progress=None):
+        """ Ingest the given datafiles
+
+            Parameters
+            ----------
+            filelist : list
+                List of the names of the datafiles
+
+            progress : callable, optional
+                Called as progress(nfiles_done, nfiles_total, filename, nrows) after each
+                file finishes, nrows is None if the file failed. Default is None.
+
+            Returns
+            -------
+            dict
+                Dictionary with the keys 'files' (number of files ingested), 'rows'
+                (number of rows ingested) and 'failed' (dictionary of filename: error message)
+        """
+        if self.datafile_metadata is None:
+            import despydmdb.desdmdbi as desdmdbi
+            dbh = desdmdbi.DesDmDbi(self.desfile, self.section)
+            self.datafile_metadata = dbh.get_datafile_metadata(self.filetype)
+            dbh.close()
+
+        summary = {'files': 0, 'rows': 0, 'failed': {}}
+        ntotal = len(filelist)
+        pool = sessionpool.create_pool(self.nworkers, _init_ingest_worker,
+                                       (self.desfile, self.section, self.datafile_metadata, self.hdu,
+                                        self.reader, self.chunksize, self.filename_column))
+        completed = False
+        try:
+            for (ndone, (filename, nrows, err)) in enumerate(pool.imap_unordered(_ingest_file, filelist), 1):
+                if err is None:
+                    summary['files'] += 1
+                    summary['rows'] += nrows
+                else:
+                    summary['failed'][filename] = err
+                miscutils.fwdebug(1, 'DESDBI_DEBUG', f"ingested {ndone}/{ntotal} files ({summary['rows']} rows)")
+                if progress is not None:
+                    progress(ndone, ntotal, filename, nrows)
+            completed = True
+        finally:
+            sessionpool.shutdown_pool(pool, completed)
+        return summary
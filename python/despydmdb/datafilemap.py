@@ -0,0 +1,207 @@
+"""
+    Compile the datafile metadata returned by DesDmDbi.get_datafile_metadata into a
+    reusable plan which maps whole tables (numpy structured arrays, as read from FITS
+    binary tables or parsed XML tables) onto the columns of the target DB table.
+"""
+
+import despymisc.miscutils as miscutils
+
+DEFAULT_BATCHSIZE = 10000
+
+# datafile_datatype values and the numpy types the data are converted to
+DATATYPE_MAP = {'int': 'int64',
+                'integer': 'int64',
+                'short': 'int64',
+                'long': 'int64',
+                'float': 'float64',
+                'double': 'float64',
+                'real': 'float64',
+                'char': 'str',
+                'string': 'str',
+                'varchar': 'str',
+                'varchar2': 'str'}
+
+
+class DatafileRowMapper:
+    """ Reusable mapping of one hdu of a datafile onto its target table
+
+        The per attribute interpretation of the metadata is done once, when the
+        mapper is created, after which whole tables are converted into column
+        arrays with numpy operations only.
+
+        Parameters
+        ----------
+        datafile_metadata : list
+            [target_table_name, metadata] as returned by DesDmDbi.get_datafile_metadata
+
+        hdu : str
+            The name of the hdu to compile the mapping for (case insensitive)
+    """
+
+    def __init__(self, datafile_metadata, hdu):
+        (self.tablename, metadata) = datafile_metadata
+        self.hdu = None
+        for key in metadata:
+            if str(key).lower() == str(hdu).lower():
+                self.hdu = key
+                break
+        if self.hdu is None:
+            raise ValueError(f"Invalid hdu ({hdu}) - no datafile metadata for table {self.tablename}")
+
+        # plan is list of (attribute, numpy type or None, target columns)
+        self.plan = []
+        self.columns = []
+        for attribute, info in metadata[self.hdu].items():
+            dtype = None
+            if info['datatype'] is not None:
+                dtype = DATATYPE_MAP.get(info['datatype'].lower())
+            self.plan.append((attribute.lower(), dtype, list(info['columns'])))
+            self.columns.extend(info['columns'])
+        miscutils.fwdebug(3, 'DESDBI_DEBUG', f"compiled {len(self.plan)} attributes into {len(self.columns)} columns for {self.tablename}")
+
+    @classmethod
+    def from_db(cls, dbh, filetype, hdu):
+        """ Create a mapper from the datafile metadata stored in the database
+
+            Parameters
+            ----------
+            dbh : DesDmDbi
+                The database handle to use
+
+            filetype : str
+                The filetype of the datafile
+
+            hdu : str
+                The name of the hdu to compile the mapping for
+
+            Returns
+            -------
+            DatafileRowMapper
+        """
+        return cls(dbh.get_datafile_metadata(filetype), hdu)
+
+    def map_table(self, data, extra=None):
+        """ Convert a whole table into the column arrays of the target table
+
+            Parameters
+            ----------
+            data : numpy structured array
+                The table data, field names are matched case insensitively to the
+                attribute names
+
+            extra : dict, optional
+                Constant values (column name as key) to add to every row, e.g. the filename.
+                Default is None.
+
+            Returns
+            -------
+            tuple
+                (list of target column names, list of numpy arrays, one per column)
+        """
+        import numpy
+
+        names = {name.lower(): name for name in data.dtype.names}
+        nrows = len(data)
+        arrays = []
+        for (attribute, dtype, columns) in self.plan:
+            if attribute not in names:
+                raise ValueError(f"Missing attribute {attribute} in hdu {self.hdu} data")
+            field = data[names[attribute]]
+            if field.dtype.kind == 'S':
+                field = numpy.char.rstrip(numpy.char.decode(field, 'ascii'))
+            if dtype is not None:
+                field = self._convert(attribute, field, dtype)
+
+            # multi-position attributes (e.g. FLUX_APER) fill one column per position
+            field = field.reshape(nrows, int(numpy.prod(field.shape[1:])))
+            if field.shape[1] < len(columns):
+                raise ValueError(f"Attribute {attribute} has {field.shape[1]} positions, but is mapped to {len(columns)} columns")
+            arrays.extend(field[:, pos] for pos in range(len(columns)))
+
+        columns = list(self.columns)
+        if extra:
+            for (col, val) in extra.items():
+                columns.append(col)
+                arrays.append(numpy.full(nrows, val, dtype=object))
+        return columns, arrays
+
+    @staticmethod
+    def _convert(attribute, field, dtype):
+        """ Convert the values of an attribute to the numpy type of its datatype,
+            raising ValueError instead of losing information (e.g. truncating floats
+            or converting NaN to an integer)
+        """
+        import numpy
+
+        if field.dtype.kind in 'US':
+            # text tables (e.g. XML) are parsed, invalid values raise ValueError
+            return field.astype(dtype)
+        if numpy.dtype(dtype).kind == 'i':
+            if field.dtype.kind == 'f':
+                if not numpy.all(numpy.isfinite(field)) or numpy.any(field != numpy.floor(field)):
+                    raise ValueError(f"Attribute {attribute} has non-integer values but datatype int")
+                return field.astype(dtype)
+            if field.dtype.kind == 'u':
+                # e.g. 64 bit FITS columns with TZERO, only values within range can be stored
+                if field.size and field.max() > numpy.iinfo(dtype).max:
+                    raise ValueError(f"Attribute {attribute} has values too large for datatype int")
+                return field.astype(dtype)
+            if not numpy.can_cast(field.dtype, dtype, casting='safe'):
+                raise ValueError(f"Cannot convert attribute {attribute} from {field.dtype} to {dtype}")
+            return field.astype(dtype, copy=False)
+        if not numpy.can_cast(field.dtype, dtype, casting='same_kind'):
+            raise ValueError(f"Cannot convert attribute {attribute} from {field.dtype} to {dtype}")
+        return field.astype(dtype, casting='same_kind', copy=False)
+
+    def iter_batches(self, data, batchsize=DEFAULT_BATCHSIZE, extra=None):
+        """ Convert a whole table into insert-ready batches of rows
+
+            Parameters
+            ----------
+            data : numpy structured array
+                The table data
+
+            batchsize : int, optional
+                The maximum number of rows per batch. Default is DEFAULT_BATCHSIZE.
+
+            extra : dict, optional
+                Constant values (column name as key) to add to every row. Default is None.
+
+            Yields
+            ------
+            tuple
+                (list of target column names, list of row tuples)
+        """
+        (columns, arrays) = self.map_table(data, extra)
+        for start in range(0, len(data), batchsize):
+            stop = start + batchsize
+            yield columns, list(zip(*[arr[start:stop].tolist() for arr in arrays]))
+
+    def insert(self, dbh, data, batchsize=DEFAULT_BATCHSIZE, extra=None):
+        """ Insert a whole table into the target table using array inserts,
+            does not commit
+
+            Parameters
+            ----------
+            dbh : DesDmDbi
+                The database handle to use
+
+            data : numpy structured array
+                The table data
+
+            batchsize : int, optional
+                The maximum number of rows per array insert. Default is DEFAULT_BATCHSIZE.
+
+            extra : dict, optional
+                Constant values (column name as key) to add to every row. Default is None.
+
+            Returns
+            -------
+            int
+                The number of rows inserted
+        """
+        nrows = 0
+        for (columns, rows) in self.iter_batches(data, batchsize, extra):
+            dbh.insert_many(self.tablename, columns, rows)
+            nrows += len(rows)
+        return nrows
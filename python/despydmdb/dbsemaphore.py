@@ -98,9 +98,11 @@ class DBSemaphore:
 
                 time.sleep(TRYINTERVAL)
 
-                miscutils.fwdebug(3, "SEMAPHORE_DEBUG", "SEM - BEG - remake db connection")
-                self.dbh = desdmdbi.DesDmDbi(desfile, section)
-                miscutils.fwdebug(3, "SEMAPHORE_DEBUG", "SEM - END - remake db connection")
+                # only log in again if the session is really gone
+                if not self.dbh.ping():
+                    miscutils.fwdebug(3, "SEMAPHORE_DEBUG", "SEM - BEG - remake db connection")
+                    self.dbh.reconnect()
+                    miscutils.fwdebug(3, "SEMAPHORE_DEBUG", "SEM - END - remake db connection")
 
                 curs = self.dbh.cursor()
                 self.slot = curs.var(cx_Oracle.NUMBER)
@@ -11,11 +11,34 @@ __version__ = "$Rev: 48543 $"
 
 import socket
 import collections
+import contextlib
+import functools
+import itertools
+import time
 
 import despydb.desdbi as desdbi
 import despydmdb.dmdb_defs as dmdbdefs
 import despymisc.miscutils as miscutils
 
+# cacheable configuration (name of the get_<name> function) and the tables it is built from
+CONFIG_TABLES = collections.OrderedDict([
+    ('site_info', ('ops_site', 'ops_site_val')),
+    ('archive_info', ('ops_archive', 'ops_archive_val')),
+    ('archive_transfer_info', ('ops_archive_transfer', 'ops_archive_transfer_val')),
+    ('job_file_mvmt_info', ('ops_job_file_mvmt', 'ops_job_file_mvmt_val')),
+    ('all_filetype_metadata', ('ops_metadata', 'ops_filetype', 'ops_filetype_metadata')),
+])
+
+# retry_idempotent defaults
+RETRY_MAXTRIES = 3
+RETRY_DELAY = 5
+
+# maximum number of statements kept parsed on their own cursor, least recently used are closed first
+STMT_CACHE_MAXENTRIES = 50
+
+# tables the datafile metadata cache is built from
+DATAFILE_TABLES = ('ops_datafile_table', 'ops_datafile_metadata')
+
 class DesDmDbi(desdbi.DesDbi):
     """ Build on base DES db class adding DB functions used across various DM projects
 
@@ -34,10 +57,372 @@ class DesDmDbi(desdbi.DesDbi):
         threaded : bool, False
             Whether to make the created handle thread safe. Default is False.
 
+        stmtcachesize : int, optional
+            Size of the client side statement cache of the connection (Oracle only).
+            Default is None (use the driver default).
+
     """
 
-    def __init__(self, desfile=None, section=None, connection=None, threaded=False):
+    def __init__(self, desfile=None, section=None, connection=None, threaded=False, stmtcachesize=None):
+        # set before connecting, the overridden close may be called by the base class
+        self._own_connection = connection is None
+        self.stmtcachesize = stmtcachesize
+        # cursors can't be shared between threads, so statements aren't reused on threaded handles
+        self._reuse_statements = not threaded
+        self._stmt_cursors = collections.OrderedDict()
+        self.stmt_stats = {'prepares': 0, 'executes': 0}
+        self._datafile_metadata_cache = None
+        self._config_cache = {}
+        self._table_fingerprints = {}
+        self._archive_router = None
+
         desdbi.DesDbi.__init__(self, desfile, section, retry=True, connection=connection, threaded=threaded)
+        self._set_stmtcachesize()
+
+    def _set_stmtcachesize(self):
+        """ Apply the configured client statement cache size to the connection """
+        if self.stmtcachesize is not None and hasattr(self.con, 'stmtcachesize'):
+            self.con.stmtcachesize = self.stmtcachesize
+
+
+    def ping(self):
+        """ Cheap check whether the connection is still usable
+
+            Returns
+            -------
+            bool
+                True if the database responded
+        """
+        try:
+            if hasattr(self.con, 'ping'):
+                self.con.ping()
+            else:
+                curs = self.cursor()
+                curs.execute("select 1 from dual" if self.is_oracle() else "select 1")
+                curs.fetchall()
+                curs.close()
+        except Exception as err:
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"ping failed: {err}")
+            return False
+        return True
+
+
+    def reconnect(self):
+        """ Replace the connection of this handle with a new login using the original
+            options (services file entry, threaded, stmtcachesize).  The services file
+            isn't read again.  The cached configuration and datafile metadata are kept,
+            uncommitted work is lost.
+        """
+        if not self._own_connection:
+            raise ValueError("Cannot reconnect a handle created from an existing connection")
+
+        miscutils.fwdebug(0, 'DESDBI_DEBUG', "reconnecting to the database")
+        self._close_cached_cursors()
+        try:
+            desdbi.DesDbi.close(self)
+        except Exception as err:
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"error closing old connection: {err}")
+
+        # DesDbi.__init__ parsed the services file entry into configdict and connect
+        # logs in with it, with the original retry and threaded settings
+        desdbi.DesDbi.connect(self)
+        self._set_stmtcachesize()
+
+
+    def retry_idempotent(self, func, *args, maxtries=RETRY_MAXTRIES, delay=RETRY_DELAY, **kwargs):
+        """ Call an idempotent operation, reconnecting and retrying if it fails because
+            the connection was lost.  Errors raised while the connection is alive, or
+            by a handle created from an existing connection (which can't reconnect),
+            are passed on without retrying.
+
+            Parameters
+            ----------
+            func : callable
+                The operation, typically a method of this handle (e.g. self.get_site_info)
+
+            maxtries : int, optional
+                The maximum number of attempts, default is RETRY_MAXTRIES
+
+            delay : int, optional
+                Seconds to wait before reconnecting, default is RETRY_DELAY
+
+            Returns
+            -------
+            The return value of func
+        """
+        trycnt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                if trycnt >= maxtries or not self._own_connection or self.ping():
+                    raise
+                miscutils.fwdebug(0, 'DESDBI_DEBUG', f"connection lost ({err}), retrying ({trycnt}/{maxtries})")
+                time.sleep(delay)
+                self.reconnect()
+                trycnt += 1
+
+
+    @contextlib.contextmanager
+    def _execute_cached(self, key, sql, params=None):
+        """ Execute a fixed statement on a cursor kept for it, so repeated calls reuse
+            the already parsed statement.  At most STMT_CACHE_MAXENTRIES statements
+            are kept.  Statements are not kept on threaded handles or when key is None,
+            the cursor is closed on exit instead.
+
+            Parameters
+            ----------
+            key : tuple or None
+                Key identifying the statement, None for a statement which must not be kept
+
+            sql : str or callable
+                The statement, or a function returning it which is only called
+                the first time
+
+            params : dict, optional
+                Bind values, default is None
+
+            Yields
+            ------
+            cursor
+                The executed cursor, its results must be consumed inside the with block
+        """
+        if key is None or not self._reuse_statements:
+            curs = self.cursor()
+            try:
+                curs.execute(sql() if callable(sql) else sql, params if params is not None else {})
+                yield curs
+            finally:
+                curs.close()
+            return
+
+        if key in self._stmt_cursors:
+            (sql, curs) = self._stmt_cursors[key]
+            self._stmt_cursors.move_to_end(key)
+        else:
+            if callable(sql):
+                sql = sql()
+            curs = self.cursor()
+            self._stmt_cursors[key] = (sql, curs)
+            self.stmt_stats['prepares'] += 1
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"preparing statement {key} ({self.stmt_stats['prepares']} prepared): {sql}")
+            if len(self._stmt_cursors) > STMT_CACHE_MAXENTRIES:
+                (_, (_, oldcurs)) = self._stmt_cursors.popitem(last=False)
+                oldcurs.close()
+        self.stmt_stats['executes'] += 1
+        curs.execute(sql, params if params is not None else {})
+        yield curs
+
+
+    def _close_cached_cursors(self):
+        """ Close the cursors kept for the fixed statements """
+        for (_, curs) in self._stmt_cursors.values():
+            try:
+                curs.close()
+            except Exception as err:
+                miscutils.fwdebug(3, 'DESDBI_DEBUG', f"error closing cached cursor: {err}")
+        self._stmt_cursors = collections.OrderedDict()
+
+
+    def close(self):
+        """ Close the cached cursors and the connection """
+        self._close_cached_cursors()
+        desdbi.DesDbi.close(self)
+
+
+    def get_stmt_stats(self):
+        """ Return the client side statement reuse counters
+
+            Returns
+            -------
+            dict
+                Dictionary with the keys 'prepares' (statements parsed on a new cursor),
+                'executes' (executions of cached statements) and 'cached' (number of
+                statements currently cached)
+        """
+        stats = dict(self.stmt_stats)
+        stats['cached'] = len(self._stmt_cursors)
+        return stats
+
+
+    def get_session_parse_counts(self):
+        """ Return the server side parse counts of this session (Oracle only, requires
+            access to v$mystat and v$statname)
+
+            Returns
+            -------
+            dict
+                Dictionary with the statistic names (e.g. 'parse count (total)') as keys
+        """
+        if not self.is_oracle():
+            return {}
+        sql = """select n.name, s.value from v$mystat s, v$statname n
+                 where s.statistic# = n.statistic# and n.name like 'parse count%'"""
+        curs = self.cursor()
+        curs.execute(sql)
+        counts = {name: value for (name, value) in curs}
+        curs.close()
+        return counts
+
+
+    def _cached_update_row(self, tablename, updatevals, wherevals):
+        """ Update rows like basic_update_row, but the statement is built once per
+            combination of table and columns and then reused with bind variables
+
+            Parameters
+            ----------
+            tablename : str
+                The name of the table to update
+
+            updatevals : dict
+                The column names and new values, None sets the column to NULL, the value
+                of get_current_timestamp_str sets the current timestamp and TO_DATE(...)
+                strings are put into the statement as is (which then isn't reused)
+
+            wherevals : dict
+                The column names and values of the rows to update, None matches NULL
+
+            Returns
+            -------
+            int
+                The number of rows updated, raises an exception if it is 0
+        """
+        ctstr = self.get_current_timestamp_str()
+        params = {}
+        setkey = []
+        reuse = True
+        for (col, val) in updatevals.items():
+            if val is None:
+                setkey.append((col, 'NULL'))
+            elif isinstance(val, str) and (val == ctstr or val.startswith('TO_DATE')):
+                setkey.append((col, val))
+                reuse = reuse and val == ctstr
+            else:
+                setkey.append((col, None))
+                params[f"u_{col}"] = val
+        wherekey = []
+        for (col, val) in wherevals.items():
+            wherekey.append((col, val is None))
+            if val is not None:
+                params[f"w_{col}"] = val
+
+        def build_sql():
+            sets = [f"{col}={inline if inline is not None else self.get_named_bind_string('u_' + col)}"
+                    for (col, inline) in setkey]
+            wheres = [f"{col} is NULL" if isnull else f"{col}={self.get_named_bind_string('w_' + col)}"
+                      for (col, isnull) in wherekey]
+            return f"update {tablename} set {', '.join(sets)} where {' and '.join(wheres)}"
+
+        key = ('update', tablename.lower(), tuple(setkey), tuple(wherekey)) if reuse else None
+        with self._execute_cached(key, build_sql, params) as curs:
+            rowcount = curs.rowcount
+        if rowcount == 0:
+            raise Exception(f"Error: 0 rows updated in table {tablename}")
+        return rowcount
+
+
+    def _iter_rows(self, sql, params=None, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Execute a query and lazily yield its rows, fetching arraysize rows at a time
+
+            Parameters
+            ----------
+            sql : str
+                The query
+
+            params : dict, optional
+                Bind values for the query, default is None
+
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
+            tuple
+                (list of lower case column names, row)
+        """
+        curs = self.cursor()
+        curs.arraysize = arraysize
+        try:
+            curs.execute(sql, params if params is not None else {})
+            desc = [d[0].lower() for d in curs.description]
+            for row in curs:
+                yield desc, row
+        finally:
+            curs.close()
+
+
+    def fetch_columnar(self, sql, params=None, arraysize=dmdbdefs.DB_ARRAYSIZE, output='numpy', dtypes=None):
+        """ Execute a query and yield its results as batches of columns, intended for
+            large results such as joins against the global temp tables
+
+            The type of each column is taken from the cursor description (see
+            columnar.description_kinds), so all batches have the same types.
+
+            Parameters
+            ----------
+            sql : str
+                The query
+
+            params : dict, optional
+                Bind values for the query, default is None
+
+            arraysize : int, optional
+                The number of rows fetched (and returned) per batch, default is DB_ARRAYSIZE
+
+            output : str, optional
+                'numpy' to yield dictionaries of numpy arrays (see columnar.to_numpy_columns)
+                or 'arrow' to yield pyarrow record batches, default is 'numpy'
+
+            dtypes : dict, optional
+                Kinds ('int', 'float', 'str', 'datetime', 'binary' or 'object') of some
+                columns (lower case column name as key) replacing the ones derived from
+                the description, default is None
+
+            Yields
+            ------
+            dict or pyarrow.RecordBatch
+                One batch of at most arraysize rows, the column names are lower case
+        """
+        import despydmdb.columnar as columnar
+
+        if output not in ('numpy', 'arrow'):
+            raise ValueError(f"Invalid output type ({output})")
+
+        curs = self.cursor()
+        curs.arraysize = arraysize
+        try:
+            curs.execute(sql, params if params is not None else {})
+            names = [d[0].lower() for d in curs.description]
+            kinds = columnar.description_kinds(curs.description, dtypes)
+            if output == 'numpy':
+                convert = functools.partial(columnar.to_numpy_columns, names, kinds)
+            else:
+                convert = functools.partial(columnar.to_arrow_batch, columnar.arrow_schema(names, kinds))
+            while True:
+                rows = curs.fetchmany(arraysize)
+                if not rows:
+                    break
+                yield convert(rows)
+        finally:
+            curs.close()
+
+
+    def iter_metadata(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the rows of the OPS_METADATA table
+
+            Parameters
+            ----------
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
+            dict
+                The row with the lower case column names as keys
+        """
+        for (desc, line) in self._iter_rows("select * from ops_metadata", arraysize=arraysize):
+            yield dict(zip(desc, line))
+
 
     def get_metadata(self):
         """ Get and return the contents of the OPS_METADATA table as a dictionary
@@ -49,14 +434,8 @@ class DesDmDbi(desdbi.DesDbi):
                 header values, and the values are dictionaries with the column names as keys and
                 the row contents as the values
         """
-        sql = "select * from ops_metadata"
-        curs = self.cursor()
-        curs.execute(sql)
-        desc = [d[0].lower() for d in curs.description]
-
         result = collections.OrderedDict()
-        for line in curs:
-            d = dict(zip(desc, line))
+        for d in self.iter_metadata():
             headername = d['file_header_name'].lower()
             columnname = d['column_name'].lower()
             if headername not in result:
@@ -66,19 +445,24 @@ class DesDmDbi(desdbi.DesDbi):
             else:
                 raise Exception(f"Found duplicate row in metadata({headername}, {columnname})")
 
-        curs.close()
         return result
 
 
-    def get_all_filetype_metadata(self):
-        """ Gets a dictionary of dictionaries or string=value pairs representing
-            data from the OPS_METADATA, OPS_FILETYPE, and OPS_FILETYPE_METADATA tables.
-            This is intended to provide a complete set of filetype metadata required
-            during a run.
+    def iter_all_filetype_metadata(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the filetype metadata rows from the OPS_METADATA, OPS_FILETYPE,
+            and OPS_FILETYPE_METADATA tables (see get_all_filetype_metadata)
 
-            Returns
-            -------
+            Parameters
+            ----------
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
             dict
+                Dictionary with the keys filetype, metadata_table, filetype_mgmt, file_hdu,
+                status, derived, file_header_name and column_name, all values except
+                filetype_mgmt are lower case
         """
         sql = """select f.filetype, f.metadata_table, f.filetype_mgmt,
                     nvl(fm.file_hdu, 'primary') file_hdu,
@@ -89,36 +473,48 @@ class DesDmDbi(desdbi.DesDbi):
                     and f.filetype=fm.filetype
                     and fm.status != 'I'
                 """
-        curs = self.cursor()
-        curs.execute(sql)
-        desc = [d[0].lower() for d in curs.description]
+        for (desc, row) in self._iter_rows(sql, arraysize=arraysize):
+            info = dict(zip(desc, row))
+            for key in ['filetype', 'file_hdu', 'status', 'derived', 'file_header_name', 'column_name']:
+                info[key] = info[key].lower()
+            if info['metadata_table'] is not None:
+                info['metadata_table'] = info['metadata_table'].lower()
+            yield info
+
+
+    def get_all_filetype_metadata(self):
+        """ Gets a dictionary of dictionaries or string=value pairs representing
+            data from the OPS_METADATA, OPS_FILETYPE, and OPS_FILETYPE_METADATA tables.
+            This is intended to provide a complete set of filetype metadata required
+            during a run.
 
+            Returns
+            -------
+            dict
+        """
         result = collections.OrderedDict()
-        for row in curs:
-            info = dict(zip(desc, row))
+        for info in self.iter_all_filetype_metadata():
             ptr = result
-            ftype = info['filetype'].lower()
+            ftype = info['filetype']
             if ftype not in result:
                 result[ftype] = collections.OrderedDict({'hdus': collections.OrderedDict()})
                 if info['metadata_table'] is not None:
-                    result[ftype]['metadata_table'] = info['metadata_table'].lower()
+                    result[ftype]['metadata_table'] = info['metadata_table']
                 if info['filetype_mgmt'] is not None:
                     result[ftype]['filetype_mgmt'] = info['filetype_mgmt']
 
-            if info['file_hdu'].lower() not in result[ftype]['hdus']:
-                result[ftype]['hdus'][info['file_hdu'].lower()] = collections.OrderedDict()
-
-            ptr = result[ftype]['hdus'][info['file_hdu'].lower()]
-            if info['status'].lower() not in ptr:
-                ptr[info['status'].lower()] = collections.OrderedDict()
+            if info['file_hdu'] not in result[ftype]['hdus']:
+                result[ftype]['hdus'][info['file_hdu']] = collections.OrderedDict()
 
-            ptr = ptr[info['status'].lower()]
-            if info['derived'].lower() not in ptr:
-                ptr[info['derived'].lower()] = collections.OrderedDict()
+            ptr = result[ftype]['hdus'][info['file_hdu']]
+            if info['status'] not in ptr:
+                ptr[info['status']] = collections.OrderedDict()
 
-            ptr[info['derived'].lower()][info['file_header_name'].lower()] = info['column_name'].lower()
+            ptr = ptr[info['status']]
+            if info['derived'] not in ptr:
+                ptr[info['derived']] = collections.OrderedDict()
 
-        curs.close()
+            ptr[info['derived']][info['file_header_name']] = info['column_name']
 
         return result
 
@@ -161,6 +557,43 @@ class DesDmDbi(desdbi.DesDbi):
         return archive_info
 
 
+    def _iter_archive_transfer_rows(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the rows of the ops_archive_transfer table followed by those of
+            the ops_archive_transfer_val table.  All of the archive transfer functions
+            are built on this.
+
+            Yields
+            ------
+            tuple
+                (is_val, src, dst, key, val) where is_val tells whether the row is from
+                ops_archive_transfer_val, the ops_archive_transfer rows have key 'transfer'
+        """
+        for (_, (src, dst, transfer)) in self._iter_rows("select src,dst,transfer from ops_archive_transfer",
+                                                         arraysize=arraysize):
+            yield (False, src, dst, 'transfer', transfer)
+        for (_, row) in self._iter_rows("select src,dst,key,val from ops_archive_transfer_val",
+                                        arraysize=arraysize):
+            yield (True,) + tuple(row)
+
+
+    def iter_archive_transfer_info(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the contents of the ops_archive_transfer table followed by the
+            ops_archive_transfer_val table
+
+            Parameters
+            ----------
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
+            tuple
+                (src, dst, key, val) where the ops_archive_transfer rows have key 'transfer'
+        """
+        for row in self._iter_archive_transfer_rows(arraysize):
+            yield row[1:]
+
+
     def get_archive_transfer_info(self):
         """ Return contents of ops_archive_transfer and ops_archive_transfer_val tables as a dictionary
 
@@ -170,63 +603,88 @@ class DesDmDbi(desdbi.DesDbi):
         """
 
         archive_transfer = collections.OrderedDict()
-        sql = "select src,dst,transfer from ops_archive_transfer"
-        curs = self.cursor()
-        curs.execute(sql)
-        for row in curs:
-            if row[0] not in archive_transfer:
-                archive_transfer[row[0]] = collections.OrderedDict()
-            archive_transfer[row[0]][row[1]] = collections.OrderedDict({'transfer':row[2]})
-
-        sql = "select src,dst,key,val from ops_archive_transfer_val"
-        curs = self.cursor()
-        curs.execute(sql)
-        for row in curs:
-            if row[0] not in archive_transfer:
-                miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: found info in ops_archive_transfer_val for src archive {row[0]} which is not in ops_archive_transfer")
-                archive_transfer[row[0]] = collections.OrderedDict()
-            if row[1] not in archive_transfer[row[0]]:
-                miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: found info in ops_archive_transfer_val for dst archive {row[1]} which is not in ops_archive_transfer")
-                archive_transfer[row[0]][row[1]] = collections.OrderedDict()
-            archive_transfer[row[0]][row[1]][row[2]] = row[3]
+        for (is_val, src, dst, key, val) in self._iter_archive_transfer_rows():
+            if not is_val:
+                if src not in archive_transfer:
+                    archive_transfer[src] = collections.OrderedDict()
+                archive_transfer[src][dst] = collections.OrderedDict({key: val})
+                continue
+
+            if src not in archive_transfer:
+                miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: found info in ops_archive_transfer_val for src archive {src} which is not in ops_archive_transfer")
+                archive_transfer[src] = collections.OrderedDict()
+            if dst not in archive_transfer[src]:
+                miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: found info in ops_archive_transfer_val for dst archive {dst} which is not in ops_archive_transfer")
+                archive_transfer[src][dst] = collections.OrderedDict()
+            archive_transfer[src][dst][key] = val
         return archive_transfer
 
 
-    def get_job_file_mvmt_info(self):
-        """ Return contents of ops_job_file_mvmt and ops_job_file_mvmt_val tables as a dictionary
+    def _iter_job_file_mvmt_rows(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the rows of the ops_job_file_mvmt table followed by those of the
+            ops_job_file_mvmt_val table, with missing archives given as 'no_archive'.
+            All of the job file movement functions are built on this.
 
-            Returns
-            -------
-            dict
+            Yields
+            ------
+            tuple
+                (is_val, site, home_archive, target_archive, key, val) where is_val tells
+                whether the row is from ops_job_file_mvmt_val, the ops_job_file_mvmt rows
+                have key 'mvmtclass'
         """
-        # [site][home][target][key] = [val]  where req key is mvmtclass
-
-        sql = "select site,home_archive,target_archive,mvmtclass from ops_job_file_mvmt"
-        curs = self.cursor()
-        curs.execute(sql)
-        info = collections.OrderedDict()
-        for(site, home, target, mvmt) in curs:
+        rows = itertools.chain(
+            ((False, site, home, target, 'mvmtclass', mvmt) for (_, (site, home, target, mvmt)) in
+             self._iter_rows("select site,home_archive,target_archive,mvmtclass from ops_job_file_mvmt",
+                             arraysize=arraysize)),
+            ((True,) + tuple(row) for (_, row) in
+             self._iter_rows("select site,home_archive,target_archive,key,val from ops_job_file_mvmt_val",
+                             arraysize=arraysize)))
+        for (is_val, site, home, target, key, val) in rows:
             if home is None:
                 home = 'no_archive'
 
             if target is None:
                 target = 'no_archive'
+            yield (is_val, site, home, target, key, val)
 
-            if site not in info:
-                info[site] = collections.OrderedDict()
-            if home not in info[site]:
-                info[site][home] = collections.OrderedDict()
-            info[site][home][target] = collections.OrderedDict({'mvmtclass': mvmt})
 
-        sql = "select site,home_archive,target_archive,key,val from ops_job_file_mvmt_val"
-        curs = self.cursor()
-        curs.execute(sql)
-        for(site, home, target, key, val) in curs:
-            if home is None:
-                home = 'no_archive'
+    def iter_job_file_mvmt_info(self, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Lazily yield the contents of the ops_job_file_mvmt table followed by the
+            ops_job_file_mvmt_val table, with missing archives given as 'no_archive'
 
-            if target is None:
-                target = 'no_archive'
+            Parameters
+            ----------
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
+            tuple
+                (site, home_archive, target_archive, key, val) where the ops_job_file_mvmt
+                rows have key 'mvmtclass'
+        """
+        for row in self._iter_job_file_mvmt_rows(arraysize):
+            yield row[1:]
+
+
+    def get_job_file_mvmt_info(self):
+        """ Return contents of ops_job_file_mvmt and ops_job_file_mvmt_val tables as a dictionary
+
+            Returns
+            -------
+            dict
+        """
+        # [site][home][target][key] = [val]  where req key is mvmtclass
+
+        info = collections.OrderedDict()
+        for (is_val, site, home, target, key, val) in self._iter_job_file_mvmt_rows():
+            if not is_val:
+                if site not in info:
+                    info[site] = collections.OrderedDict()
+                if home not in info[site]:
+                    info[site][home] = collections.OrderedDict()
+                info[site][home][target] = collections.OrderedDict({key: val})
+                continue
 
             if(site not in info or
                home not in info[site] or
@@ -236,14 +694,172 @@ class DesDmDbi(desdbi.DesDbi):
         return info
 
 
+    def get_archive_router(self):
+        """ Return the archive transfer routing table, it is cached with the
+            'archive_transfer_info' config (see get_config) and rebuilt when
+            refresh_config refetches that config
+
+            Returns
+            -------
+            ArchiveRouter
+        """
+        import despydmdb.archiveroute as archiveroute
+
+        info = self.get_config('archive_transfer_info')
+        if self._archive_router is None or self._archive_router[0] is not info:
+            self._archive_router = (info, archiveroute.ArchiveRouter(info))
+        return self._archive_router[1]
+
+
+    def get_job_file_mvmt_resolver(self):
+        """ Return a resolver for the ops_job_file_mvmt and ops_job_file_mvmt_val tables,
+            the whole table is validated up front
+
+            Returns
+            -------
+            JobFileMvmtResolver
+        """
+        import despydmdb.jobfilemvmt as jobfilemvmt
+
+        mvmt_rows = []
+        val_rows = []
+        for (is_val, site, home, target, key, val) in self._iter_job_file_mvmt_rows():
+            if is_val:
+                val_rows.append((site, home, target, key, val))
+            else:
+                mvmt_rows.append((site, home, target, val))
+        return jobfilemvmt.JobFileMvmtResolver(mvmt_rows, val_rows)
+
+
+    def get_table_fingerprints(self, tables):
+        """ Cheap change probe, returns a fingerprint for each of the given tables
+            using a single query.  The fingerprint is the row count plus, on Oracle,
+            the maximum ora_rowscn so that updates are detected as well.
+
+            Parameters
+            ----------
+            tables : list
+                List of the table names
+
+            Returns
+            -------
+            dict
+                Dictionary with the lower case table names as keys and (count, scn) as values
+        """
+        scn = 'max(ora_rowscn)' if self.is_oracle() else 'NULL'
+        sql = ' union all '.join([f"select '{tab.lower()}', count(*), {scn} from {tab}" for tab in tables])
+        curs = self.cursor()
+        curs.execute(sql)
+        fingerprints = {tab: (cnt, tscn) for (tab, cnt, tscn) in curs}
+        curs.close()
+        return fingerprints
+
+
+    def get_config(self, name):
+        """ Return cached configuration, fetching it on first use.  Use refresh_config
+            to bring the cached values up to date.
+
+            Parameters
+            ----------
+            name : str
+                The name of the configuration, one of the keys of CONFIG_TABLES
+                (e.g. 'site_info' for get_site_info)
+
+            Returns
+            -------
+            dict
+                The cached output of the corresponding get_<name> function, which
+                should be treated as read-only
+        """
+        if name not in CONFIG_TABLES:
+            raise ValueError(f"Invalid config name ({name})")
+        if name not in self._config_cache:
+            # probe before fetching so changes made during the fetch are caught by the next refresh
+            self._table_fingerprints.update(self.get_table_fingerprints(CONFIG_TABLES[name]))
+            self._config_cache[name] = getattr(self, f"get_{name}")()
+        return self._config_cache[name]
+
+
+    def dump_config(self, path, names=None):
+        """ Write cached configuration to a file which jobs can read with
+            despydmdb.configcache.load_config, without importing the DB modules
+
+            Parameters
+            ----------
+            path : str
+                The name of the file
+
+            names : list, optional
+                The configuration names to write, default is None (all of CONFIG_TABLES)
+
+            Returns
+            -------
+            list
+                The names of the written configuration
+        """
+        import despydmdb.configcache as configcache
+
+        if names is None:
+            names = list(CONFIG_TABLES)
+        configcache.save_config(path, collections.OrderedDict((name, self.get_config(name)) for name in names))
+        return list(names)
+
+
+    def refresh_config(self, force=False):
+        """ Refetch the cached configuration whose tables changed since it was loaded,
+            using one probe query for all of the tables.  The datafile metadata cache
+            is reloaded as well if it is in use and its tables changed.
+
+            Parameters
+            ----------
+            force : bool, optional
+                Refetch all of the cached configuration regardless of changes, default is False
+
+            Returns
+            -------
+            list
+                The names of the refetched configuration ('datafile_metadata' for the
+                datafile metadata cache)
+        """
+        sources = collections.OrderedDict([(name, CONFIG_TABLES[name]) for name in self._config_cache])
+        if self._datafile_metadata_cache is not None:
+            sources['datafile_metadata'] = DATAFILE_TABLES
+        if not sources:
+            return []
+
+        tables = sorted({tab for tabs in sources.values() for tab in tabs})
+        current = self.get_table_fingerprints(tables)
+        refreshed = []
+        for (name, tabs) in sources.items():
+            if force or any(current[tab] != self._table_fingerprints.get(tab) for tab in tabs):
+                refreshed.append(name)
+
+        # the fingerprints of a table are only recorded once every refetch using it
+        # succeeded, so a failed refetch is retried by the next refresh
+        pending = set(refreshed)
+        try:
+            for name in refreshed:
+                miscutils.fwdebug(3, 'DESDBI_DEBUG', f"refreshing {name}")
+                if name == 'datafile_metadata':
+                    self.load_datafile_metadata_cache()
+                else:
+                    self._config_cache[name] = getattr(self, f"get_{name}")()
+                pending.discard(name)
+        finally:
+            stale = {tab for name in pending for tab in sources[name]}
+            self._table_fingerprints.update({tab: fprint for (tab, fprint) in current.items()
+                                             if tab not in stale})
+        return refreshed
+
+
     def load_artifact_gtt(self, filelist):
         """ insert file artifact information into global temp table
 
             Parameters
             ----------
             filelist : list
-                List of dictionaries, one for each file, giving the file
-                metadata to store.
+                List (or other iterable) of dictionaries, one for each file, giving the file
+                metadata to store.  Rows are inserted in chunks of DB_GTT_CHUNKSIZE.
 
             Returns
             -------
@@ -299,11 +915,81 @@ class DesDmDbi(desdbi.DesDbi):
             miscutils.fwdebug(3, 'DESDBI_DEBUG', f"row: fname={fname}, comp={comp}, filesize={filesize}, md5sum={md5sum}")
             rows.append({dmdbdefs.DB_COL_FILENAME:fname, dmdbdefs.DB_COL_COMPRESSION:comp,
                          dmdbdefs.DB_COL_FILESIZE:filesize, dmdbdefs.DB_COL_MD5SUM:md5sum})
+            if len(rows) >= dmdbdefs.DB_GTT_CHUNKSIZE:
+                self.insert_many(dmdbdefs.DB_GTT_ARTIFACT, colmap, rows)
+                rows = []
 
-        self.insert_many(dmdbdefs.DB_GTT_ARTIFACT, colmap, rows)
+        if rows:
+            self.insert_many(dmdbdefs.DB_GTT_ARTIFACT, colmap, rows)
         return dmdbdefs.DB_GTT_ARTIFACT
 
 
+    def diff_artifacts(self, filelist, archive_name=None, arraysize=dmdbdefs.DB_ARRAYSIZE):
+        """ Compare a file inventory against the files known to the database using one
+            server-side join, the differences are streamed back sorted by status:
+
+                mismatch - the file is known but its filesize or md5sum differs
+                missing  - the file is in the archive (archive_name only) but not in the inventory
+                unknown  - the file in the inventory is not known (in the archive if archive_name is given)
+
+            The inventory is loaded into the artifact GTT, which therefore must not be
+            committed or reloaded until the results have been consumed.
+
+            Parameters
+            ----------
+            filelist : list
+                List (or other iterable) of file dictionaries as accepted by load_artifact_gtt
+
+            archive_name : str, optional
+                Compare against the files in this archive (file_archive_info), default is None
+                which compares against all files in desfile and does not report missing files.
+
+            arraysize : int, optional
+                The number of rows fetched at a time, default is DB_ARRAYSIZE
+
+            Yields
+            ------
+            dict
+                Dictionary with the keys status, filename, compression, filesize, md5sum
+                (from the inventory), db_filesize and db_md5sum (from the database)
+        """
+        gtt = self.load_artifact_gtt(filelist)
+
+        params = {}
+        if archive_name is None:
+            dbfiles = "desfile"
+            join = "left outer join"
+        else:
+            dbfiles = f"""(select df.filename, df.compression, df.filesize, df.md5sum
+                          from desfile df, file_archive_info fai
+                          where fai.desfile_id = df.id and fai.archive_name = {self.get_named_bind_string('archive_name')})"""
+            join = "full outer join"
+            params['archive_name'] = archive_name
+
+        sql = f"""select case when g.filename is null then '{dmdbdefs.DB_DIFF_MISSING}'
+                              when d.filename is null then '{dmdbdefs.DB_DIFF_UNKNOWN}'
+                              else '{dmdbdefs.DB_DIFF_MISMATCH}' end status,
+                         nvl(g.filename, d.filename) filename, nvl(g.compression, d.compression) compression,
+                         g.filesize, g.md5sum, d.filesize db_filesize, d.md5sum db_md5sum
+                  from {gtt} g {join} {dbfiles} d
+                      on d.filename = g.filename and nvl(d.compression, '1') = nvl(g.compression, '1')
+                  where g.filename is null or d.filename is null
+                      or (g.filesize is not null and (d.filesize is null or d.filesize != g.filesize))
+                      or (g.md5sum is not null and (d.md5sum is null or d.md5sum != g.md5sum))
+                  order by 1, 2, 3"""
+        miscutils.fwdebug(3, 'DESDBI_DEBUG', f"sql = {sql}")
+
+        curs = self.cursor()
+        curs.arraysize = arraysize
+        try:
+            curs.execute(sql, params)
+            desc = [d[0].lower() for d in curs.description]
+            for row in curs:
+                yield dict(zip(desc, row))
+        finally:
+            curs.close()
+
+
     def load_filename_gtt(self, filelist):
         """ insert filenames into filename global temp table
 
@@ -325,27 +1011,148 @@ class DesDmDbi(desdbi.DesDbi):
         colmap = [dmdbdefs.DB_COL_FILENAME, dmdbdefs.DB_COL_COMPRESSION]
         rows = []
         for _file in filelist:
-            fname = None
-            comp = None
-            if isinstance(_file, str):
-                (fname, comp) = miscutils.parse_fullname(_file, miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
-            elif isinstance(_file, dict) and(dmdbdefs.DB_COL_FILENAME in _file or dmdbdefs.DB_COL_FILENAME.lower() in _file):
-                if dmdbdefs.DB_COL_COMPRESSION in _file:
-                    fname = _file[dmdbdefs.DB_COL_FILENAME]
-                    comp = _file[dmdbdefs.DB_COL_COMPRESSION]
-                elif dmdbdefs.DB_COL_COMPRESSION.lower() in _file:
-                    fname = _file[dmdbdefs.DB_COL_FILENAME.lower()]
-                    comp = _file[dmdbdefs.DB_COL_COMPRESSION.lower()]
-                elif dmdbdefs.DB_COL_FILENAME in _file:
-                    (fname, comp) = miscutils.parse_fullname(_file[dmdbdefs.DB_COL_FILENAME], miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
-                else:
-                    (fname, comp) = miscutils.parse_fullname(_file[dmdbdefs.DB_COL_FILENAME.lower()], miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
-            else:
-                raise ValueError(f"Invalid entry filelist({_file})")
+            (fname, comp) = self._parse_filename_entry(_file)
             rows.append({dmdbdefs.DB_COL_FILENAME:fname, dmdbdefs.DB_COL_COMPRESSION:comp})
         self.insert_many(dmdbdefs.DB_GTT_FILENAME, colmap, rows)
         return dmdbdefs.DB_GTT_FILENAME
 
+    @staticmethod
+    def _parse_filename_entry(_file):
+        """ Return (filename, compression) of a load_filename_gtt filelist entry
+
+            Parameters
+            ----------
+            _file : str or dict
+                The file name or a dictionary describing the file name
+
+            Returns
+            -------
+            tuple
+                (filename, compression)
+        """
+        fname = None
+        comp = None
+        if isinstance(_file, str):
+            (fname, comp) = miscutils.parse_fullname(_file, miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
+        elif isinstance(_file, dict) and(dmdbdefs.DB_COL_FILENAME in _file or dmdbdefs.DB_COL_FILENAME.lower() in _file):
+            if dmdbdefs.DB_COL_COMPRESSION in _file:
+                fname = _file[dmdbdefs.DB_COL_FILENAME]
+                comp = _file[dmdbdefs.DB_COL_COMPRESSION]
+            elif dmdbdefs.DB_COL_COMPRESSION.lower() in _file:
+                fname = _file[dmdbdefs.DB_COL_FILENAME.lower()]
+                comp = _file[dmdbdefs.DB_COL_COMPRESSION.lower()]
+            elif dmdbdefs.DB_COL_FILENAME in _file:
+                (fname, comp) = miscutils.parse_fullname(_file[dmdbdefs.DB_COL_FILENAME], miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
+            else:
+                (fname, comp) = miscutils.parse_fullname(_file[dmdbdefs.DB_COL_FILENAME.lower()], miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_EXTENSION)
+        else:
+            raise ValueError(f"Invalid entry filelist({_file})")
+        return (fname, comp)
+
+    def get_file_ids(self, filelist, cache=None):
+        """ Look up the desfile id and filesize of files using the filename global temp table
+
+            Parameters
+            ----------
+            filelist : list
+                List of strings of the file names, or of dictionaries describing the file names
+                (see load_filename_gtt)
+
+            cache : FileIdCache, optional
+                Local cache consulted first, only the files not found in it are looked
+                up in the database (and then added to it).  Default is None.
+
+            Returns
+            -------
+            dict
+                Dictionary with (filename, compression) as keys and dictionaries with the
+                keys 'id' and 'filesize' as values.  Files which are not in the database
+                are not included.
+        """
+        keys = list(collections.OrderedDict.fromkeys(self._parse_filename_entry(_file) for _file in filelist))
+
+        result = {}
+        misses = keys
+        if cache is not None:
+            result = cache.get_many(keys)
+            misses = [key for key in keys if key not in result]
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"file id cache: {len(result)} hits, {len(misses)} misses")
+
+        if misses:
+            gtt = self.load_filename_gtt([{dmdbdefs.DB_COL_FILENAME: fname, dmdbdefs.DB_COL_COMPRESSION: comp}
+                                          for (fname, comp) in misses])
+            sql = f"""select d.filename, d.compression, d.id, d.filesize
+                     from desfile d, {gtt} g
+                     where d.filename = g.filename and nvl(d.compression, '1') = nvl(g.compression, '1')"""
+            found = {}
+            curs = self.cursor()
+            curs.arraysize = dmdbdefs.DB_ARRAYSIZE
+            curs.execute(sql)
+            for (fname, comp, desfid, filesize) in curs:
+                found[(fname, comp)] = {'id': desfid, 'filesize': filesize}
+            curs.close()
+            if cache is not None:
+                cache.put_many(found)
+            result.update(found)
+        return result
+
+    def record_provenance(self, records, cache=None, do_commit=False):
+        """ Record which files the tasks of a job used and generated
+
+            The file ids are resolved with one join against the filename global temp
+            table (see get_file_ids) and the link rows are written with one array
+            insert per provenance table.
+
+            Parameters
+            ----------
+            records : iterable
+                (task_id, file, role) tuples where file is a file name or a dictionary
+                describing the file name (see load_filename_gtt) and role is one of the
+                keys of DB_PROV_TABLES ('used' or 'was_generated_by')
+
+            cache : FileIdCache, optional
+                Local file id cache passed on to get_file_ids, default is None
+
+            do_commit : bool, optional
+                Whether to commit the data to the database (True), default is False.
+
+            Returns
+            -------
+            dict
+                Dictionary with the roles as keys and the number of link rows inserted as values
+        """
+        links = []
+        for (task_id, _file, role) in records:
+            if role not in dmdbdefs.DB_PROV_TABLES:
+                raise ValueError(f"Invalid provenance role ({role})")
+            links.append((int(task_id), self._parse_filename_entry(_file), role))
+        if not links:
+            return {}
+
+        keys = collections.OrderedDict.fromkeys(key for (_, key, _) in links)
+        ids = self.get_file_ids([{dmdbdefs.DB_COL_FILENAME: fname, dmdbdefs.DB_COL_COMPRESSION: comp}
+                                 for (fname, comp) in keys], cache)
+        missing = [key for key in keys if key not in ids]
+        if missing:
+            raise ValueError(f"{len(missing)} files not found in desfile: {missing[:10]}")
+
+        rows = collections.OrderedDict()
+        for (task_id, key, role) in links:
+            rows.setdefault(role, collections.OrderedDict())[(task_id, ids[key]['id'])] = None
+
+        counts = {}
+        colmap = [dmdbdefs.DB_COL_TASK_ID, dmdbdefs.DB_COL_DESFILE_ID]
+        for (role, rolerows) in rows.items():
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"inserting {len(rolerows)} {role} provenance rows")
+            self.insert_many(dmdbdefs.DB_PROV_TABLES[role], colmap,
+                             [{dmdbdefs.DB_COL_TASK_ID: task_id, dmdbdefs.DB_COL_DESFILE_ID: desfid}
+                              for (task_id, desfid) in rolerows])
+            counts[role] = len(rolerows)
+
+        if do_commit:
+            self.commit()
+        return counts
+
     def load_id_gtt(self, idlist):
         """ Insert a list of id's into a global temp table
 
@@ -383,10 +1190,8 @@ class DesDmDbi(desdbi.DesDbi):
         if 'gtt' not in tablename.lower():
             raise ValueError("Invalid table name for a global temp table(missing GTT)")
 
-        sql = f"delete from {tablename}"
-        curs = self.cursor()
-        curs.execute(sql)
-        curs.close()
+        with self._execute_cached(('empty_gtt', tablename.lower()), f"delete from {tablename}"):
+            pass
 
 
     def create_task(self, name, info_table, parent_task_id=None, root_task_id=None,
@@ -467,7 +1272,7 @@ class DesDmDbi(desdbi.DesDbi):
                       'exec_host': socket.gethostname()}
         wherevals = {'id': task_id} # get task id
 
-        self.basic_update_row('task', updatevals, wherevals)
+        self._cached_update_row('task', updatevals, wherevals)
         if do_commit:
             self.commit()
 
@@ -495,38 +1300,166 @@ class DesDmDbi(desdbi.DesDbi):
         updatevals['end_time'] = self.get_current_timestamp_str()
         updatevals['status'] = status
 
-        self.basic_update_row('task', updatevals, wherevals)
+        self._cached_update_row('task', updatevals, wherevals)
         if do_commit:
             self.commit()
 
+    def get_task_tree(self, root_task_id, tree=None):
+        """ Fetch all tasks of a run (TASK rows with the given root_task_id) into a
+            parent/child index
+
+            When an existing tree is given only new tasks and the tasks which were
+            unfinished at the last fetch are queried and merged into it (the ids of
+            the tasks that changed are in tree.changed).  A count of the run's tasks
+            guards against new tasks with out of order ids, in which case the whole
+            run is fetched again.
+
+            Parameters
+            ----------
+            root_task_id : int
+                The task id of the root task of the run
+
+            tree : TaskTree, optional
+                A tree returned by a previous call, to be refreshed. Default is None.
+
+            Returns
+            -------
+            TaskTree
+        """
+        import despydmdb.tasktree as tasktree
+
+        bindstr = self.get_named_bind_string('root_task_id')
+        sql = f"select id, {', '.join(tasktree.TASK_COLUMNS)} from task where root_task_id={bindstr}"
+        params = {'root_task_id': root_task_id}
+        incremental = tree is not None and tree.max_id is not None
+        if tree is None:
+            tree = tasktree.TaskTree(root_task_id)
+        elif tree.root_task_id != root_task_id:
+            raise ValueError(f"Task tree is for root task {tree.root_task_id}, not {root_task_id}")
+
+        if incremental:
+            where = f"id > {self.get_named_bind_string('max_id')}"
+            params['max_id'] = tree.max_id
+            # the unfinished ids are bound as IN-lists of at most DB_INLIST_MAXSIZE ids
+            unfinished = sorted(tree.unfinished_ids())
+            for start in range(0, len(unfinished), dmdbdefs.DB_INLIST_MAXSIZE):
+                binds = []
+                for (num, task_id) in enumerate(unfinished[start:start + dmdbdefs.DB_INLIST_MAXSIZE], start):
+                    binds.append(self.get_named_bind_string(f"u{num}"))
+                    params[f"u{num}"] = task_id
+                where += f" or id in ({', '.join(binds)})"
+            sql += f" and ({where})"
+
+        curs = self.cursor()
+        curs.execute(sql, params)
+        desc = [d[0].lower() for d in curs.description]
+        changed = tree.update(dict(zip(desc, row)) for row in curs)
+
+        if incremental:
+            curs.execute(f"select count(*) from task where root_task_id={bindstr}", {'root_task_id': root_task_id})
+            if curs.fetchone()[0] != len(tree):
+                miscutils.fwdebug(3, 'DESDBI_DEBUG', f"task tree {root_task_id} out of sync, fetching all tasks")
+                curs.execute(f"select id, {', '.join(tasktree.TASK_COLUMNS)} from task where root_task_id={bindstr}",
+                             {'root_task_id': root_task_id})
+                tree.changed = changed + tree.update(dict(zip(desc, row)) for row in curs)
+        curs.close()
+        return tree
+
     def get_datafile_metadata(self, filetype):
         """ Gets a dictionary of all datafile(such as XML or fits table data files) metadata for the given filetype.
+            If the datafile metadata cache has been loaded (see load_datafile_metadata_cache) the
+            value is served from the cache instead of querying the database.
+
+            Parameters
+            ----------
+            filetype : str
+                The filetype to get the metadata for
+
             Returns
             -------
             list
                 [target_table_name, metadata]
         """
-        TABLE = 0
-        HDU = 1
-        ATTRIBUTE = 2
-        POSITION = 3
-        COLUMN = 4
-        DATATYPE = 5
-        FORMAT = 6
+        if self._datafile_metadata_cache is not None:
+            try:
+                return self._datafile_metadata_cache[filetype.lower()]
+            except KeyError:
+                raise ValueError('Invalid filetype - missing entries in datafile tables')
 
         bindstr = self.get_named_bind_string("afiletype")
-        sql = """select table_name, hdu, lower(attribute_name), position, lower(column_name), datafile_datatype, data_format
+        sql = """select df.filetype, table_name, hdu, lower(attribute_name), position, lower(column_name), datafile_datatype, data_format
                 from OPS_DATAFILE_TABLE df, OPS_DATAFILE_METADATA md
                 where df.filetype = md.filetype and current_flag=1 and lower(df.filetype) = lower(""" + bindstr + """)
                 order by md.attribute_name, md.POSITION"""
-        result = collections.OrderedDict()
+        with self._execute_cached(('get_datafile_metadata',), sql, {"afiletype": filetype}) as curs:
+            allinfo = self._build_datafile_metadata(curs)
+        if not allinfo:
+            raise ValueError('Invalid filetype - missing entries in datafile tables')
+        return allinfo[filetype.lower()]
+
+    def load_datafile_metadata_cache(self):
+        """ Load the datafile metadata for every current filetype with a single query
+            and keep it in memory.  Subsequent calls to get_datafile_metadata are
+            served from this cache until clear_datafile_metadata_cache is called.
+            The cached values are shared between callers and should be treated as
+            read-only.
+
+            Returns
+            -------
+            dict
+                Dictionary with the lower case filetype as keys and [target_table_name, metadata]
+                as values
+        """
+        sql = """select df.filetype, table_name, hdu, lower(attribute_name), position, lower(column_name), datafile_datatype, data_format
+                from OPS_DATAFILE_TABLE df, OPS_DATAFILE_METADATA md
+                where df.filetype = md.filetype and current_flag=1
+                order by df.filetype, md.attribute_name, md.POSITION"""
+        self._table_fingerprints.update(self.get_table_fingerprints(DATAFILE_TABLES))
         curs = self.cursor()
-        curs.execute(sql, {"afiletype": filetype})
+        curs.execute(sql)
+        self._datafile_metadata_cache = self._build_datafile_metadata(curs)
+        curs.close()
+        miscutils.fwdebug(3, 'DESDBI_DEBUG', f"cached datafile metadata for {len(self._datafile_metadata_cache)} filetypes")
+        return self._datafile_metadata_cache
+
+    def clear_datafile_metadata_cache(self):
+        """ Invalidate the datafile metadata cache, get_datafile_metadata will query
+            the database again until the cache is reloaded
+        """
+        self._datafile_metadata_cache = None
 
-        tablename = None
+    @staticmethod
+    def _build_datafile_metadata(curs):
+        """ Build the datafile metadata dictionaries from the rows of a datafile metadata query
+
+            Parameters
+            ----------
+            curs : cursor
+                Executed cursor returning (filetype, table_name, hdu, attribute_name, position,
+                column_name, datafile_datatype, data_format) rows ordered by filetype,
+                attribute_name and position
+
+            Returns
+            -------
+            dict
+                Dictionary with the lower case filetype as keys and [target_table_name, metadata]
+                as values
+        """
+        FILETYPE = 0
+        TABLE = 1
+        HDU = 2
+        ATTRIBUTE = 3
+        POSITION = 4
+        COLUMN = 5
+        DATATYPE = 6
+        FORMAT = 7
+
+        allinfo = collections.OrderedDict()
         for row in curs:
-            if tablename is None:
-                tablename = row[TABLE]
+            ftype = row[FILETYPE].lower()
+            if ftype not in allinfo:
+                allinfo[ftype] = [row[TABLE], collections.OrderedDict()]
+            result = allinfo[ftype][1]
             if row[HDU] not in result:
                 result[row[HDU]] = {}
             if row[ATTRIBUTE] not in result[row[HDU]]:
@@ -538,7 +1471,4 @@ class DesDmDbi(desdbi.DesDbi):
                 result[row[HDU]][row[ATTRIBUTE]]['columns'].append(row[COLUMN])
             else:
                 result[row[HDU]][row[ATTRIBUTE]]['columns'][row[POSITION]] = row[COLUMN]
-        curs.close()
-        if tablename is None:
-            raise ValueError('Invalid filetype - missing entries in datafile tables')
-        return [tablename, result]
+        return allinfo
@@ -6,6 +6,26 @@ DB_COL_COMPRESSION = "COMPRESSION"
 DB_COL_FILESIZE = "FILESIZE"
 DB_COL_MD5SUM = "MD5SUM"
 DB_COL_ID = "ID"
+DB_COL_TASK_ID = "TASK_ID"
+DB_COL_DESFILE_ID = "DESFILE_ID"
 DB_GTT_FILENAME = "OPM_FILENAME_GTT"
 DB_GTT_ARTIFACT = "GTT_ARTIFACT"
 DB_GTT_ID = "GTT_ID"
+
+# number of rows inserted into a GTT at a time
+DB_GTT_CHUNKSIZE = 50000
+# cursor arraysize used when streaming large results
+DB_ARRAYSIZE = 5000
+# maximum number of values in one IN-list (Oracle allows 1000)
+DB_INLIST_MAXSIZE = 1000
+
+# diff_artifacts status values
+DB_DIFF_MISMATCH = "mismatch"
+DB_DIFF_MISSING = "missing"
+DB_DIFF_UNKNOWN = "unknown"
+
+# provenance roles and their link tables
+DB_PROV_USED = "used"
+DB_PROV_WAS_GENERATED_BY = "was_generated_by"
+DB_PROV_TABLES = {DB_PROV_USED: "OPM_USED",
+                  DB_PROV_WAS_GENERATED_BY: "OPM_WAS_GENERATED_BY"}
@@ -0,0 +1,115 @@
+"""
+    Local persistent cache of desfile ids, keyed on (filename, compression), used by
+    DesDmDbi.get_file_ids so only cache misses are looked up in the database
+"""
+
+import sqlite3
+import time
+
+import despymisc.miscutils as miscutils
+
+DEFAULT_MAXENTRIES = 1000000
+# seconds to wait for another process holding the cache file lock
+LOCK_TIMEOUT = 60
+
+
+class FileIdCache:
+    """ Size bounded, least recently used cache of desfile ids stored in a SQLite file
+
+        The file may be shared by many processes.  Desfile ids never change, but
+        entries of files removed from the database stay until they are evicted
+        or the cache is cleared.
+
+        Parameters
+        ----------
+        path : str
+            The name of the SQLite file, created if it doesn't exist
+
+        maxentries : int, optional
+            The maximum number of cached files, the least recently used ones are
+            evicted first. Default is DEFAULT_MAXENTRIES.
+    """
+
+    def __init__(self, path, maxentries=DEFAULT_MAXENTRIES):
+        self.path = path
+        self.maxentries = maxentries
+        self.conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self.conn:
+            self.conn.execute("""create table if not exists fileid (
+                                     filename text not null,
+                                     compression text not null,
+                                     id integer not null,
+                                     filesize integer,
+                                     last_used real not null,
+                                     primary key (filename, compression))""")
+            self.conn.execute("create index if not exists fileid_last_used on fileid (last_used)")
+
+    @staticmethod
+    def _comp(comp):
+        """ compression as stored, None cannot be part of the primary key """
+        return '' if comp is None else comp
+
+    def get_many(self, keys):
+        """ Return the cached entries of the given files
+
+            Parameters
+            ----------
+            keys : list
+                List of (filename, compression) tuples
+
+            Returns
+            -------
+            dict
+                Dictionary with (filename, compression) as keys and dictionaries with the
+                keys 'id' and 'filesize' as values, for the cached files only
+        """
+        hits = {}
+        curs = self.conn.cursor()
+        for (fname, comp) in keys:
+            curs.execute("select id, filesize from fileid where filename=? and compression=?",
+                         (fname, self._comp(comp)))
+            row = curs.fetchone()
+            if row is not None:
+                hits[(fname, comp)] = {'id': row[0], 'filesize': row[1]}
+        curs.close()
+
+        if hits:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany("update fileid set last_used=? where filename=? and compression=?",
+                                      [(now, fname, self._comp(comp)) for (fname, comp) in hits])
+        return hits
+
+    def put_many(self, entries):
+        """ Add files to the cache, evicting the least recently used ones if needed
+
+            Parameters
+            ----------
+            entries : dict
+                Dictionary with (filename, compression) as keys and dictionaries with the
+                keys 'id' and 'filesize' as values
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("insert or replace into fileid (filename, compression, id, filesize, last_used) values (?, ?, ?, ?, ?)",
+                                  [(fname, self._comp(comp), info['id'], info['filesize'], now)
+                                   for ((fname, comp), info) in entries.items()])
+            excess = len(self) - self.maxentries
+            if excess > 0:
+                miscutils.fwdebug(3, 'DESDBI_DEBUG', f"file id cache: evicting {excess} entries")
+                self.conn.execute("delete from fileid where rowid in (select rowid from fileid order by last_used limit ?)",
+                                  (excess,))
+
+    def clear(self):
+        """ Remove all entries from the cache """
+        with self.conn:
+            self.conn.execute("delete from fileid")
+
+    def close(self):
+        """ Close the cache file """
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("select count(*) from fileid").fetchone()[0]
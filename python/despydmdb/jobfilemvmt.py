@@ -0,0 +1,117 @@
+"""
+    Precomputed lookup of the job file movement class (ops_job_file_mvmt and
+    ops_job_file_mvmt_val tables)
+"""
+
+NO_ARCHIVE = 'no_archive'
+
+
+def normalize_archive(archive):
+    """ Return the archive name used in the job file movement table
+
+        Parameters
+        ----------
+        archive : str or None
+            The archive name, None or an empty string means no archive
+
+        Returns
+        -------
+        str
+    """
+    if archive is None or archive == '' or archive.lower() == NO_ARCHIVE:
+        return NO_ARCHIVE
+    return archive
+
+
+class JobFileMvmtResolver:
+    """ Resolve the job file movement info of a (site, home archive, target archive)
+        combination with a single dictionary lookup
+
+        The whole table is checked when the resolver is created, all problems
+        are reported together.
+
+        Parameters
+        ----------
+        mvmt_rows : iterable
+            (site, home_archive, target_archive, mvmtclass) rows of ops_job_file_mvmt
+
+        val_rows : iterable, optional
+            (site, home_archive, target_archive, key, val) rows of ops_job_file_mvmt_val,
+            default is None
+    """
+
+    def __init__(self, mvmt_rows, val_rows=None):
+        self._info = {}
+        errors = []
+        for (site, home, target, mvmt) in mvmt_rows:
+            combo = (site, normalize_archive(home), normalize_archive(target))
+            if combo in self._info:
+                errors.append(f"duplicate entry in ops_job_file_mvmt{combo}")
+            self._info[combo] = {'mvmtclass': mvmt}
+
+        if val_rows is not None:
+            for (site, home, target, key, val) in val_rows:
+                combo = (site, normalize_archive(home), normalize_archive(target))
+                if combo not in self._info:
+                    errors.append(f"found info in ops_job_file_mvmt_val({site}, {home}, {target}, {key}, {val}) which is not in ops_job_file_mvmt")
+                else:
+                    self._info[combo][key] = val
+
+        if errors:
+            raise ValueError("Error: invalid job file movement info:\n    " + "\n    ".join(errors))
+
+    @classmethod
+    def from_info(cls, info):
+        """ Create a resolver from the output of DesDmDbi.get_job_file_mvmt_info
+
+            Parameters
+            ----------
+            info : dict
+                [site][home_archive][target_archive][key] = val
+
+            Returns
+            -------
+            JobFileMvmtResolver
+        """
+        mvmt_rows = []
+        val_rows = []
+        for (site, homes) in info.items():
+            for (home, targets) in homes.items():
+                for (target, vals) in targets.items():
+                    mvmt_rows.append((site, home, target, vals.get('mvmtclass')))
+                    val_rows.extend((site, home, target, key, val) for (key, val) in vals.items()
+                                    if key != 'mvmtclass')
+        return cls(mvmt_rows, val_rows)
+
+    def resolve(self, site, home_archive, target_archive):
+        """ Return the job file movement info
+
+            Parameters
+            ----------
+            site : str
+                The name of the site
+
+            home_archive : str or None
+                The name of the home archive, None for no archive
+
+            target_archive : str or None
+                The name of the target archive, None for no archive
+
+            Returns
+            -------
+            dict
+                Dictionary containing 'mvmtclass' plus the ops_job_file_mvmt_val keys,
+                which should be treated as read-only
+        """
+        combo = (site, normalize_archive(home_archive), normalize_archive(target_archive))
+        try:
+            return self._info[combo]
+        except KeyError:
+            raise ValueError(f"No job file movement info for site={combo[0]}, home_archive={combo[1]}, target_archive={combo[2]}")
+
+    def __contains__(self, combo):
+        (site, home, target) = combo
+        return (site, normalize_archive(home), normalize_archive(target)) in self._info
+
+    def __len__(self):
+        return len(self._info)
@@ -0,0 +1,147 @@
+"""
+    Batched ingestion of file header values into the filetype metadata tables
+    described by DesDmDbi.get_all_filetype_metadata
+"""
+
+import collections
+
+import despymisc.miscutils as miscutils
+
+DEFAULT_BATCHSIZE = 10000
+
+# OPS_FILETYPE_METADATA status of values which must be present
+STATUS_REQUIRED = 'r'
+
+
+class HeaderMetadataIngester:
+    """ Map header values of files to rows of their filetype's metadata_table and
+        insert them with array inserts
+
+        The header to column mapping of a filetype (all of its hdu/status/derived
+        entries) is resolved once, the first time the filetype is seen.  Rows are
+        grouped by target table and written when batchsize rows are pending or
+        flush is called.  Nothing is committed.
+
+        Parameters
+        ----------
+        dbh : DesDmDbi
+            The database handle to use
+
+        filetype_metadata : dict, optional
+            The output of get_all_filetype_metadata, default is None (queried from the
+            database).
+
+        batchsize : int, optional
+            The number of pending rows which triggers a flush. Default is DEFAULT_BATCHSIZE.
+    """
+
+    def __init__(self, dbh, filetype_metadata=None, batchsize=DEFAULT_BATCHSIZE):
+        self.dbh = dbh
+        if filetype_metadata is None:
+            filetype_metadata = dbh.get_all_filetype_metadata()
+        self.filetype_metadata = filetype_metadata
+        self.batchsize = batchsize
+        self.ninserted = 0
+        self._plans = {}
+        self._pending = collections.OrderedDict()
+        self._npending = 0
+
+    def _compile(self, filetype):
+        """ Resolve the header to column mapping of a filetype
+
+            Returns
+            -------
+            tuple
+                (metadata table, tuple of column names, list of [(hdu, header name, required), ...]
+                giving the possible sources of each column)
+        """
+        ftype = filetype.lower()
+        if ftype not in self.filetype_metadata:
+            raise ValueError(f"Invalid filetype ({filetype}) - missing entries in filetype metadata")
+        ftinfo = self.filetype_metadata[ftype]
+        if 'metadata_table' not in ftinfo:
+            raise ValueError(f"Filetype {filetype} does not have a metadata table")
+
+        sources = collections.OrderedDict()
+        for (hdu, hduinfo) in ftinfo['hdus'].items():
+            for (status, statusinfo) in hduinfo.items():
+                for derivedinfo in statusinfo.values():
+                    for (hdrname, column) in derivedinfo.items():
+                        if column not in sources:
+                            sources[column] = []
+                        sources[column].append((hdu, hdrname, status == STATUS_REQUIRED))
+
+        plan = (ftinfo['metadata_table'], tuple(sources.keys()), list(sources.values()))
+        miscutils.fwdebug(3, 'DESDBI_DEBUG', f"compiled {len(plan[1])} metadata columns for filetype {ftype}")
+        return plan
+
+    def add(self, filetype, headers):
+        """ Add the metadata row of one file
+
+            Parameters
+            ----------
+            filetype : str
+                The filetype of the file
+
+            headers : dict
+                Dictionary with the hdu names as keys and dictionaries of header name: value
+                as values (names are case insensitive)
+        """
+        ftype = filetype.lower()
+        if ftype not in self._plans:
+            self._plans[ftype] = self._compile(ftype)
+        (table, columns, sources) = self._plans[ftype]
+
+        hdrs = {}
+        for (hdu, vals) in headers.items():
+            hdrs[hdu.lower()] = {key.lower(): val for (key, val) in vals.items()}
+
+        row = []
+        for (column, colsources) in zip(columns, sources):
+            val = None
+            required = False
+            for (hdu, hdrname, req) in colsources:
+                required |= req
+                if hdu in hdrs and hdrname in hdrs[hdu]:
+                    val = hdrs[hdu][hdrname]
+                    break
+            if val is None and required:
+                raise ValueError(f"Missing required metadata for column {column} of filetype {ftype}")
+            row.append(val)
+
+        key = (table, columns)
+        if key not in self._pending:
+            self._pending[key] = []
+        self._pending[key].append(row)
+        self._npending += 1
+        if self._npending >= self.batchsize:
+            self.flush()
+
+    def add_many(self, records):
+        """ Add the metadata rows of many files
+
+            Parameters
+            ----------
+            records : iterable
+                (filetype, headers) tuples, see add
+        """
+        for (filetype, headers) in records:
+            self.add(filetype, headers)
+
+    def flush(self):
+        """ Insert all pending rows, one array insert per metadata table
+
+            Returns
+            -------
+            int
+                The number of rows inserted
+        """
+        nrows = 0
+        for ((table, columns), rows) in self._pending.items():
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"inserting {len(rows)} rows into {table}")
+            self.dbh.insert_many(table, list(columns), rows)
+            nrows += len(rows)
+        self._pending = collections.OrderedDict()
+        self._npending = 0
+        self.ninserted += nrows
+        return nrows
@@ -0,0 +1,168 @@
+"""
+    Run filename GTT loads and joins for very large file lists partitioned across
+    a pool of worker processes, each with its own DB session (and therefore its
+    own copy of the GTT)
+"""
+
+import despymisc.miscutils as miscutils
+import despydmdb.dmdb_defs as dmdbdefs
+import despydmdb.sessionpool as sessionpool
+
+# maximum number of files per partition, bounds the memory used per worker
+DEFAULT_PARTSIZE = 100000
+
+
+def partition_filelist(filelist, npart):
+    """ Split a filelist into partitions by hashing (filename, compression), so
+        duplicate entries always end up in the same partition
+
+        Parameters
+        ----------
+        filelist : list
+            List of strings of the file names, or of dictionaries describing the file
+            names (see DesDmDbi.load_filename_gtt)
+
+        npart : int
+            The number of partitions
+
+        Returns
+        -------
+        list
+            List of npart lists of {FILENAME: filename, COMPRESSION: compression} dictionaries
+    """
+    import despydmdb.desdmdbi as desdmdbi
+
+    parts = [[] for _ in range(npart)]
+    for _file in filelist:
+        key = desdmdbi.DesDmDbi._parse_filename_entry(_file)  #pylint: disable=protected-access
+        parts[hash(key) % npart].append({dmdbdefs.DB_COL_FILENAME: key[0],
+                                         dmdbdefs.DB_COL_COMPRESSION: key[1]})
+    return [part for part in parts if part]
+
+
+def _query_partition(args):
+    """ Load one partition into this worker's filename GTT and run the query on it """
+    (part, sql, params) = args
+    dbh = sessionpool.worker_dbh()
+    try:
+        dbh.load_filename_gtt(part)
+        curs = dbh.cursor()
+        curs.arraysize = dmdbdefs.DB_ARRAYSIZE
+        curs.execute(sql, params)
+        rows = curs.fetchall()
+        curs.close()
+    finally:
+        dbh.rollback()
+    return rows
+
+
+def _file_ids_partition(part):
+    """ Look up the file ids of one partition in this worker's session """
+    dbh = sessionpool.worker_dbh()
+    try:
+        return dbh.get_file_ids(part)
+    finally:
+        dbh.rollback()
+
+
+def _run_partitions(desfile, section, func, tasks, nworkers):
+    """ Run func on each task in a session pool and yield the results as they finish """
+    pool = sessionpool.create_pool(min(nworkers, len(tasks)), sessionpool.init_worker, (desfile, section))
+    completed = False
+    try:
+        for (ndone, res) in enumerate(pool.imap_unordered(func, tasks), 1):
+            miscutils.fwdebug(3, 'DESDBI_DEBUG', f"finished {ndone}/{len(tasks)} GTT partitions")
+            yield res
+        completed = True
+    finally:
+        sessionpool.shutdown_pool(pool, completed)
+
+
+def _partitions(filelist, nworkers, partsize):
+    """ Return the number of workers and the partitions of the filelist """
+    import multiprocessing
+
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    npart = max(nworkers, -(-len(filelist) // partsize))
+    return nworkers, partition_filelist(filelist, npart)
+
+
+def parallel_gtt_query(desfile, section, filelist, sql, params=None, nworkers=None, partsize=DEFAULT_PARTSIZE):
+    """ Run a query joining the filename GTT for a very large filelist using several sessions
+
+        Each partition of the filelist is loaded into the filename GTT of a worker's
+        session and the query is run there.  As long as each result row depends
+        on a single GTT row the merged rows are the same as running the query in
+        one session, but not in the same order.
+
+        Parameters
+        ----------
+        desfile : str
+            The name of the services file to use.
+
+        section : str
+            The name of the section in the services file to use.
+
+        filelist : list
+            List of strings of the file names, or of dictionaries describing the file
+            names (see DesDmDbi.load_filename_gtt)
+
+        sql : str
+            The query, using the filename GTT (DB_GTT_FILENAME)
+
+        params : dict, optional
+            Bind values for the query, default is None
+
+        nworkers : int, optional
+            The number of worker processes. Default is None (the number of cores).
+
+        partsize : int, optional
+            The maximum number of files per partition. Default is DEFAULT_PARTSIZE.
+
+        Yields
+        ------
+        tuple
+            The result rows
+    """
+    (nworkers, parts) = _partitions(filelist, nworkers, partsize)
+    if not parts:
+        return
+    tasks = [(part, sql, params if params is not None else {}) for part in parts]
+    for rows in _run_partitions(desfile, section, _query_partition, tasks, nworkers):
+        yield from rows
+
+
+def parallel_get_file_ids(desfile, section, filelist, nworkers=None, partsize=DEFAULT_PARTSIZE):
+    """ DesDmDbi.get_file_ids for a very large filelist using several sessions
+
+        Parameters
+        ----------
+        desfile : str
+            The name of the services file to use.
+
+        section : str
+            The name of the section in the services file to use.
+
+        filelist : list
+            List of strings of the file names, or of dictionaries describing the file
+            names (see DesDmDbi.load_filename_gtt)
+
+        nworkers : int, optional
+            The number of worker processes. Default is None (the number of cores).
+
+        partsize : int, optional
+            The maximum number of files per partition. Default is DEFAULT_PARTSIZE.
+
+        Returns
+        -------
+        dict
+            Dictionary with (filename, compression) as keys and dictionaries with the
+            keys 'id' and 'filesize' as values
+    """
+    (nworkers, parts) = _partitions(filelist, nworkers, partsize)
+    result = {}
+    if parts:
+        for ids in _run_partitions(desfile, section, _file_ids_partition, parts, nworkers):
+            result.update(ids)
+    return result
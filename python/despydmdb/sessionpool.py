@@ -0,0 +1,101 @@
+"""
+    Give each worker process of a multiprocessing pool its own DB session
+"""
+
+# multiprocessing and the DB modules are imported inside the functions, only when a pool is used
+import despymisc.miscutils as miscutils
+
+# the DB handle of the current worker process
+_WORKER_DBH = None
+
+
+def init_worker(desfile, section, threaded=False):
+    """ Pool initializer, opens the DB session of this worker process
+
+        Parameters
+        ----------
+        desfile : str
+            The name of the services file to use.
+
+        section : str
+            The name of the section in the services file to use.
+
+        threaded : bool, optional
+            Whether to make the created handle thread safe. Default is False.
+    """
+    global _WORKER_DBH  #pylint: disable=global-statement
+    import multiprocessing
+    import multiprocessing.util
+    import despydmdb.desdmdbi as desdmdbi
+
+    miscutils.fwdebug(3, 'DESDBI_DEBUG', f"opening worker session (pid {multiprocessing.current_process().pid})")
+    _WORKER_DBH = desdmdbi.DesDmDbi(desfile, section, threaded=threaded)
+    # close the session when the worker exits after the pool is closed
+    multiprocessing.util.Finalize(None, _close_worker_dbh, exitpriority=10)
+
+
+def _close_worker_dbh():
+    """ Close the DB session of this worker process """
+    global _WORKER_DBH  #pylint: disable=global-statement
+    if _WORKER_DBH is not None:
+        try:
+            _WORKER_DBH.close()
+        except Exception as err:
+            miscutils.fwdebug(0, 'DESDBI_DEBUG', f"WARNING: error closing worker session: {err}")
+        _WORKER_DBH = None
+
+
+def worker_dbh():
+    """ Return the DB handle of the current worker process
+
+        Returns
+        -------
+        DesDmDbi
+    """
+    if _WORKER_DBH is None:
+        raise RuntimeError("No DB session in this process, init_worker must be used as the pool initializer")
+    return _WORKER_DBH
+
+
+def create_pool(nworkers, initializer, initargs):
+    """ Create a pool of worker processes, each with its own DB session
+
+        Parameters
+        ----------
+        nworkers : int or None
+            The number of worker processes, None uses the number of cores.
+
+        initializer : callable
+            Module level function run in each worker, it must call init_worker
+
+        initargs : tuple
+            Arguments to the initializer
+
+        Returns
+        -------
+        multiprocessing.Pool
+    """
+    import multiprocessing
+
+    if nworkers is None:
+        nworkers = multiprocessing.cpu_count()
+    return multiprocessing.Pool(nworkers, initializer, initargs)
+
+
+def shutdown_pool(pool, completed):
+    """ Stop a pool created by create_pool.  After a complete run the workers
+        exit normally, closing their DB sessions, otherwise they are terminated.
+
+        Parameters
+        ----------
+        pool : multiprocessing.Pool
+            The pool
+
+        completed : bool
+            Whether all of the pool's work finished
+    """
+    if completed:
+        pool.close()
+    else:
+        pool.terminate()
+    pool.join()
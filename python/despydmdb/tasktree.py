@@ -0,0 +1,114 @@
+"""
+    In-memory parent/child index of the tasks of a run (all TASK rows sharing a
+    root_task_id), see DesDmDbi.get_task_tree
+"""
+
+# task columns kept for each task besides its id
+TASK_COLUMNS = ['parent_task_id', 'name', 'label', 'start_time', 'end_time', 'status']
+
+
+class TaskTree:
+    """ Parent/child index of the tasks of one run
+
+        Parameters
+        ----------
+        root_task_id : int
+            The task id of the root task of the run
+
+        Attributes
+        ----------
+        tasks : dict
+            Dictionary with the task ids as keys and dictionaries of the TASK_COLUMNS as values
+
+        children : dict
+            Dictionary with the task ids as keys and lists of the ids of their child tasks as values
+
+        changed : list
+            The ids of the tasks added or changed by the last update
+    """
+
+    def __init__(self, root_task_id):
+        self.root_task_id = root_task_id
+        self.tasks = {}
+        self.children = {}
+        self.changed = []
+        self.max_id = None
+
+    def update(self, rows):
+        """ Add or replace tasks
+
+            Parameters
+            ----------
+            rows : iterable
+                Dictionaries with the key 'id' plus the TASK_COLUMNS
+
+            Returns
+            -------
+            list
+                The ids of the tasks which were added or changed
+        """
+        changed = []
+        for row in rows:
+            task_id = row['id']
+            info = {col: row[col] for col in TASK_COLUMNS}
+            old = self.tasks.get(task_id)
+            if old == info:
+                continue
+            if old is None:
+                parent = info['parent_task_id']
+                if parent is not None and task_id != self.root_task_id:
+                    self.children.setdefault(parent, []).append(task_id)
+                if self.max_id is None or task_id > self.max_id:
+                    self.max_id = task_id
+            self.tasks[task_id] = info
+            changed.append(task_id)
+        self.changed = changed
+        return changed
+
+    def unfinished_ids(self):
+        """ Return the ids of the tasks without an end time, the only ones which can still change
+
+            Returns
+            -------
+            list
+        """
+        return [task_id for (task_id, info) in self.tasks.items() if info['end_time'] is None]
+
+    def get_children(self, task_id):
+        """ Return the ids of the child tasks of a task
+
+            Parameters
+            ----------
+            task_id : int
+                The task id
+
+            Returns
+            -------
+            list
+        """
+        return self.children.get(task_id, [])
+
+    def walk(self, task_id=None):
+        """ Depth-first traversal of the tree
+
+            Parameters
+            ----------
+            task_id : int, optional
+                The task id to start at, default is None (the root task)
+
+            Yields
+            ------
+            tuple
+                (depth, task id)
+        """
+        stack = [(0, self.root_task_id if task_id is None else task_id)]
+        while stack:
+            (depth, tid) = stack.pop()
+            yield depth, tid
+            stack.extend((depth + 1, child) for child in reversed(self.get_children(tid)))
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
@@ -6,16 +6,53 @@ import os
 import stat
 import time
 import sys
+import tempfile
+import subprocess
 
 from contextlib import contextmanager
 from io import StringIO
+from unittest import mock
 
 import despydmdb.dbsemaphore as semaphore
 import despydmdb.desdmdbi as dmdbi
 import despydmdb.dmdb_defs as dmdbdefs
+import despydmdb.datafilemap as datafilemap
+import despydmdb.datafileingest as datafileingest
+import despydmdb.metadataingest as metadataingest
+import despydmdb.jobfilemvmt as jobfilemvmt
+import despydmdb.archiveroute as archiveroute
+import despydmdb.filecache as filecache
+import despydmdb.parallelgtt as parallelgtt
+import despydmdb.columnar as columnar
+import despydmdb.configcache as configcache
 import despydb.desdbi as desdbi
 from MockDBI import MockConnection
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def missing_file_reader(filename, hdu, chunksize):
+    raise IOError(f"cannot open {filename}")
+    yield
+
+
+def memory_task_reader(filename, hdu, chunksize):
+    """ 5 rows of task ids/names, offset by the number in the file name """
+    first = 900000 + 10 * int(filename[4])
+    data = numpy.zeros(5, dtype=[('ID', 'i8'), ('NAME', 'S10')])
+    data['ID'] = numpy.arange(first, first + 5)
+    data['NAME'] = b'ingested'
+    for start in range(0, len(data), chunksize):
+        yield data[start:start + chunksize]
+
 
 @contextmanager
 def capture_output():
@@ -167,6 +204,48 @@ port    =   0
     def test_init(self):
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
 
+        # a failed login which closes the handle passes on the login error
+        def failing_init(self, *args, **kwargs):
+            self.close()
+            raise RuntimeError('login failed')
+        with mock.patch.object(desdbi.DesDbi, '__init__', failing_init), \
+             mock.patch.object(desdbi.DesDbi, 'close'):
+            self.assertRaises(RuntimeError, dmdbi.DesDmDbi, self.sfile, 'db-test')
+
+    def test_reconnect(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test', stmtcachesize=10)
+        self.assertTrue(dbh.ping())
+        cache = dbh.load_datafile_metadata_cache()
+        dbh.empty_gtt(dmdbdefs.DB_GTT_ID)
+        # the services file is only read when the handle is created
+        configdict = dbh.configdict
+        with mock.patch.object(desdbi.DesDbi, '__init__', side_effect=AssertionError('services file reread')):
+            dbh.reconnect()
+        self.assertTrue(dbh.ping())
+        self.assertIs(dbh.configdict, configdict)
+        self.assertEqual(dbh.get_stmt_stats()['cached'], 0)
+        self.assertIs(dbh.get_datafile_metadata('cat_finalcut'), cache['cat_finalcut'])
+        self.assertTrue('descampuscluster' in dbh.get_site_info())
+
+        desdbi.DesDbi.close(dbh)
+        self.assertFalse(dbh.ping())
+        data = dbh.retry_idempotent(dbh.get_site_info, delay=0)
+        self.assertTrue('descampuscluster' in data)
+        self.assertTrue(dbh.ping())
+
+        # a handle using an existing connection passes on the original error
+        other = dmdbi.DesDmDbi(connection=dbh.con)
+        with mock.patch.object(other, 'ping', return_value=False):
+            self.assertRaises(RuntimeError, other.retry_idempotent,
+                              mock.Mock(side_effect=RuntimeError('lost connection')), delay=0)
+
+        calls = []
+        def failing():
+            calls.append(1)
+            raise ValueError('not a connection problem')
+        self.assertRaises(ValueError, dbh.retry_idempotent, failing, delay=0)
+        self.assertEqual(len(calls), 1)
+
     def test_get_metadata(self):
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
         data = dbh.get_metadata()
@@ -180,6 +259,27 @@ port    =   0
         self.assertTrue('hdus' in data['cat_finalcut'])
         self.assertTrue('primary' in data['cat_finalcut']['hdus'])
 
+    def test_iter_config(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        rows = list(dbh.iter_metadata(arraysize=2))
+        self.assertEqual(len(rows), sum(len(cols) for cols in dbh.get_metadata().values()))
+
+        ftmeta = dbh.get_all_filetype_metadata()
+        for info in dbh.iter_all_filetype_metadata(arraysize=2):
+            self.assertEqual(ftmeta[info['filetype']]['hdus'][info['file_hdu']][info['status']][info['derived']][info['file_header_name']],
+                             info['column_name'])
+
+        transfer = dbh.get_archive_transfer_info()
+        for (src, dst, key, val) in dbh.iter_archive_transfer_info():
+            self.assertEqual(transfer[src][dst][key], val)
+
+        mvmt = dbh.get_job_file_mvmt_info()
+        rows = list(dbh.iter_job_file_mvmt_info())
+        self.assertTrue(('descampuscluster', 'desar2home', 'no_archive', 'mvmtclass',
+                         mvmt['descampuscluster']['desar2home']['no_archive']['mvmtclass']) in rows)
+        for (site, home, target, key, val) in rows:
+            self.assertEqual(mvmt[site][home][target][key], val)
+
     def test_get_site_info(self):
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
         data = dbh.get_site_info()
@@ -205,6 +305,61 @@ port    =   0
         self.assertTrue('no_archive' in data['descampuscluster']['desar2home'])
         self.assertTrue('mvmtclass' in data['descampuscluster']['desar2home']['no_archive'])
 
+    def test_get_archive_router(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        router = dbh.get_archive_router()
+        self.assertIs(dbh.get_archive_router(), router)
+        for (src, dsts) in dbh.get_archive_transfer_info().items():
+            for (dst, info) in dsts.items():
+                if src != dst and 'transfer' in info:
+                    self.assertTrue(router.has_route(src, dst))
+        dbh.refresh_config(force=True)
+        self.assertIsNot(dbh.get_archive_router(), router)
+
+    def test_get_job_file_mvmt_resolver(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        info = dbh.get_job_file_mvmt_info()
+        resolver = dbh.get_job_file_mvmt_resolver()
+        self.assertEqual(resolver.resolve('descampuscluster', 'desar2home', None),
+                         info['descampuscluster']['desar2home']['no_archive'])
+        self.assertTrue(('descampuscluster', 'desar2home', '') in resolver)
+
+    def test_get_table_fingerprints(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        fps = dbh.get_table_fingerprints(['OPS_SITE', 'ops_site_val'])
+        self.assertEqual(sorted(fps.keys()), ['ops_site', 'ops_site_val'])
+        self.assertTrue(fps['ops_site'][0] > 0)
+
+    def test_config_cache(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        self.assertEqual(dbh.refresh_config(), [])
+        sites = dbh.get_config('site_info')
+        self.assertTrue('descampuscluster' in sites)
+        self.assertIs(dbh.get_config('site_info'), sites)
+        dbh.get_config('archive_info')
+        self.assertRaises(ValueError, dbh.get_config, 'bad_info')
+
+        self.assertEqual(dbh.refresh_config(), [])
+        dbh.basic_insert_row('ops_site_val', {'name': 'descampuscluster', 'key': 'test_key', 'val': 'test_val'})
+        self.assertEqual(dbh.refresh_config(), ['site_info'])
+        self.assertEqual(dbh.get_config('site_info')['descampuscluster']['test_key'], 'test_val')
+        dbh.rollback()
+        self.assertEqual(dbh.refresh_config(force=True), ['site_info', 'archive_info'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'config.json')
+            self.assertEqual(dbh.dump_config(path, ['site_info']), ['site_info'])
+            self.assertEqual(configcache.load_config(path)['site_info'], dbh.get_config('site_info'))
+
+        # a failed refetch is retried by the next refresh
+        dbh.basic_insert_row('ops_site_val', {'name': 'descampuscluster', 'key': 'test_key', 'val': 'test_val'})
+        get_site_info = dbh.get_site_info
+        dbh.get_site_info = mock.Mock(side_effect=RuntimeError('refetch failed'))
+        self.assertRaises(RuntimeError, dbh.refresh_config)
+        dbh.get_site_info = get_site_info
+        self.assertEqual(dbh.refresh_config(), ['site_info'])
+        dbh.rollback()
+
     def test_load_artifact_gtt(self):
         files = [{dmdbdefs.DB_COL_FILENAME: 'test.fits',
                   dmdbdefs.DB_COL_COMPRESSION: '.fz',
@@ -243,6 +398,22 @@ port    =   0
                  {dmdbdefs.DB_COL_FILENAME: 'test4.fts.fz'}]
         self.assertRaises(ValueError, dbh.load_artifact_gtt, files)
 
+    def test_diff_artifacts(self):
+        files = [{dmdbdefs.DB_COL_FILENAME: 'notindb2.fits',
+                  dmdbdefs.DB_COL_COMPRESSION: '.fz',
+                  dmdbdefs.DB_COL_FILESIZE: 128,
+                  dmdbdefs.DB_COL_MD5SUM: 'ab66249844ae'},
+                 {'fullname': 'notindb1.fits'}]
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        res = list(dbh.diff_artifacts(iter(files)))
+        self.assertEqual([r['filename'] for r in res], ['notindb1.fits', 'notindb2.fits'])
+        self.assertEqual({r['status'] for r in res}, {dmdbdefs.DB_DIFF_UNKNOWN})
+        self.assertEqual(res[1]['filesize'], 128)
+        self.assertIsNone(res[1]['db_filesize'])
+        dbh.rollback()
+
+        self.assertRaises(ValueError, list, dbh.diff_artifacts([{'filenam': 'test.fits'}]))
+
     def test_load_filename_gtt(self):
         files = ['test1.fits.fz',
                  {dmdbdefs.DB_COL_FILENAME: 'test.fits',
@@ -266,6 +437,53 @@ port    =   0
 
         self.assertRaises(ValueError, dbh.load_filename_gtt, [12345])
 
+    def test_get_file_ids(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        self.assertEqual(dbh.get_file_ids(['notindb.fits.fz', {'filename': 'notindb2.fits'}]), {})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = filecache.FileIdCache(os.path.join(tmpdir, 'fileid.db'))
+            cache.put_many({('cached.fits', '.fz'): {'id': 12, 'filesize': 100}})
+            res = dbh.get_file_ids(['cached.fits.fz', 'notindb.fits'], cache)
+            self.assertEqual(res, {('cached.fits', '.fz'): {'id': 12, 'filesize': 100}})
+            cache.close()
+        self.assertRaises(ValueError, dbh.get_file_ids, [12345])
+
+    def test_parallel_gtt(self):
+        files = [f"test{i}.fits.fz" for i in range(25)] + ['test3.fits.fz', {'filename': 'test30.fits'}]
+        parts = parallelgtt.partition_filelist(files, 4)
+        self.assertEqual(sum(len(part) for part in parts), len(files))
+        self.assertEqual(len([part for part in parts if {'FILENAME': 'test3.fits', 'COMPRESSION': '.fz'} in part]), 1)
+
+        sql = f"select {dmdbdefs.DB_COL_FILENAME}, {dmdbdefs.DB_COL_COMPRESSION} from {dmdbdefs.DB_GTT_FILENAME}"
+        rows = list(parallelgtt.parallel_gtt_query(self.sfile, 'db-test', files, sql, nworkers=2, partsize=10))
+        self.assertEqual(len(rows), len(files))
+        self.assertTrue(('test30.fits', None) in rows)
+        self.assertEqual(parallelgtt.parallel_get_file_ids(self.sfile, 'db-test', files, nworkers=2), {})
+
+    def test_record_provenance(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        task_id = dbh.create_task('exec1', None, i_am_root=True)
+        self.assertEqual(dbh.record_provenance([]), {})
+        self.assertRaises(ValueError, dbh.record_provenance, [(task_id, 'test.fits', 'made')])
+        self.assertRaises(ValueError, dbh.record_provenance, [(task_id, 'notindb.fits', dmdbdefs.DB_PROV_USED)])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = filecache.FileIdCache(os.path.join(tmpdir, 'fileid.db'))
+            cache.put_many({('in1.fits', '.fz'): {'id': 101, 'filesize': 10},
+                            ('in2.fits', None): {'id': 102, 'filesize': 10},
+                            ('out.fits', '.fz'): {'id': 103, 'filesize': 10}})
+            counts = dbh.record_provenance([(task_id, 'in1.fits.fz', dmdbdefs.DB_PROV_USED),
+                                            (task_id, 'in2.fits', dmdbdefs.DB_PROV_USED),
+                                            (task_id, {'filename': 'in2.fits', 'compression': None}, dmdbdefs.DB_PROV_USED),
+                                            (task_id, 'out.fits.fz', dmdbdefs.DB_PROV_WAS_GENERATED_BY)],
+                                           cache=cache)
+            cache.close()
+        self.assertEqual(counts, {dmdbdefs.DB_PROV_USED: 2, dmdbdefs.DB_PROV_WAS_GENERATED_BY: 1})
+        curs = dbh.cursor()
+        curs.execute("select count(*) from %s where task_id=%i" % (dmdbdefs.DB_PROV_TABLES[dmdbdefs.DB_PROV_USED], task_id))
+        self.assertEqual(curs.fetchall()[0][0], 2)
+        dbh.rollback()
+
     def test_load_id_gtt(self):
         ids = [1, 5, 10, 15, 20, 25]
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
@@ -280,6 +498,23 @@ port    =   0
         ids = [1, 2, 3.5, 6]
         self.assertRaises(ValueError, dbh.load_id_gtt, ids)
 
+    @unittest.skipIf(numpy is None, "numpy is not available")
+    def test_fetch_columnar(self):
+        ids = list(range(1, 12))
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        tab = dbh.load_id_gtt(ids)
+        batches = list(dbh.fetch_columnar(f"select {dmdbdefs.DB_COL_ID} from {tab} order by {dmdbdefs.DB_COL_ID}",
+                                          arraysize=5, dtypes={'id': 'int'}))
+        self.assertEqual([len(batch['id']) for batch in batches], [5, 5, 1])
+        self.assertEqual(batches[0]['id'].dtype, numpy.int64)
+        self.assertEqual(numpy.concatenate([batch['id'] for batch in batches]).tolist(), ids)
+        if pyarrow is not None:
+            batches = list(dbh.fetch_columnar(f"select {dmdbdefs.DB_COL_ID} from {tab}", output='arrow',
+                                              dtypes={'id': 'int'}))
+            self.assertEqual(sum(batch.num_rows for batch in batches), len(ids))
+        self.assertRaises(ValueError, list, dbh.fetch_columnar(f"select * from {tab}", output='list'))
+        dbh.rollback()
+
     def test_empty_gtt(self):
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
         self.assertRaises(ValueError, dbh.empty_gtt, 'gt_tab')
@@ -316,6 +551,90 @@ port    =   0
         self.assertEqual(len(res), 1)
         self.assertIsNone(res[0][0])
 
+    def test_get_task_tree(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        root_id = dbh.create_task('root_task', None, i_am_root=True, do_begin=True)
+        parent_id = dbh.create_task('parent_task', None, root_id, root_id, do_begin=True)
+        child1 = dbh.create_task('exec1', None, parent_id, root_id, label='child1', do_begin=True)
+        dbh.end_task(child1, 0)
+
+        tree = dbh.get_task_tree(root_id)
+        self.assertEqual(len(tree), 3)
+        self.assertEqual(tree.get_children(root_id), [parent_id])
+        self.assertEqual(tree.get_children(parent_id), [child1])
+        self.assertEqual(tree.tasks[child1]['status'], 0)
+        self.assertEqual(sorted(tree.unfinished_ids()), sorted([root_id, parent_id]))
+        self.assertEqual(list(tree.walk()), [(0, root_id), (1, parent_id), (2, child1)])
+
+        # only new and unfinished tasks are fetched again, the root stays unfinished
+        fetched = []
+        update = tree.update
+        def counting_update(rows):
+            rows = list(rows)
+            fetched.extend(row['id'] for row in rows)
+            return update(rows)
+        tree.update = counting_update
+
+        child2 = dbh.create_task('exec2', None, parent_id, root_id, label='child2')
+        dbh.end_task(parent_id, 1)
+        # refreshing leaves the id global temp table alone
+        gtt = dbh.load_id_gtt([child1])
+        self.assertIs(dbh.get_task_tree(root_id, tree), tree)
+        self.assertEqual(sorted(fetched), sorted([root_id, parent_id, child2]))
+        curs = dbh.cursor()
+        curs.execute(f"select {dmdbdefs.DB_COL_ID} from {gtt}")
+        self.assertEqual(curs.fetchall(), [(child1,)])
+        self.assertEqual(sorted(tree.changed), sorted([parent_id, child2]))
+        self.assertEqual(tree.get_children(parent_id), [child1, child2])
+        self.assertEqual(tree.tasks[parent_id]['status'], 1)
+
+        del fetched[:]
+        with mock.patch.object(dmdbdefs, 'DB_INLIST_MAXSIZE', 1):
+            dbh.get_task_tree(root_id, tree)
+        self.assertEqual(tree.changed, [])
+        self.assertEqual(sorted(fetched), sorted([root_id, child2]))
+        self.assertRaises(ValueError, dbh.get_task_tree, child1, tree)
+        dbh.rollback()
+
+    def test_statement_reuse(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test', stmtcachesize=40)
+        root_id = dbh.create_task('root_task', None, i_am_root=True)
+        child_id = dbh.create_task('child_task', None, root_id, root_id)
+        before = dbh.get_stmt_stats()
+        for task_id in [root_id, child_id]:
+            dbh.begin_task(task_id)
+            dbh.end_task(task_id, 0)
+            dbh.empty_gtt(dmdbdefs.DB_GTT_ID)
+            dbh.get_datafile_metadata('cat_finalcut')
+        after = dbh.get_stmt_stats()
+        self.assertEqual(after['executes'] - before['executes'], 8)
+        self.assertTrue(after['prepares'] - before['prepares'] <= 4)
+        self.assertEqual(after['cached'], after['prepares'])
+
+        curs = dbh.cursor()
+        curs.execute("select status from task where id=%i" % child_id)
+        self.assertEqual(curs.fetchall()[0][0], 0)
+        self.assertEqual(dbh._cached_update_row('task', {'status': 1, 'label': None}, {'id': child_id}), 1)
+        curs.execute("select status, label from task where id=%i" % child_id)
+        self.assertEqual(curs.fetchall()[0], (1, None))
+        self.assertRaises(Exception, dbh.begin_task, child_id + 1000000)
+
+        # the least recently used statements are closed first
+        with mock.patch.object(dmdbi, 'STMT_CACHE_MAXENTRIES', 2):
+            dbh.get_datafile_metadata('cat_finalcut')
+            dbh.empty_gtt(dmdbdefs.DB_GTT_ID)
+            dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
+            self.assertEqual(dbh.get_stmt_stats()['cached'], 2)
+        dbh.rollback()
+        dbh.close()
+
+        # statements are not reused on threaded handles
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test', threaded=True)
+        dbh.empty_gtt(dmdbdefs.DB_GTT_ID)
+        dbh.get_datafile_metadata('cat_finalcut')
+        self.assertEqual(dbh.get_stmt_stats()['cached'], 0)
+        dbh.close()
+
     def test_get_datafile_metadata(self):
         dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
         data = dbh.get_datafile_metadata('cat_finalcut')
@@ -325,5 +644,348 @@ port    =   0
 
         self.assertRaises(ValueError, dbh.get_datafile_metadata, 'cat_something')
 
+    def test_datafile_ingest_pipeline_failures(self):
+        seen = []
+        pipeline = datafileingest.DatafileIngestPipeline(self.sfile, 'db-test', 'cat_finalcut', 'PRIMARY',
+                                                         nworkers=2, reader=missing_file_reader)
+        summary = pipeline.run(['a.fits', 'b.fits'], progress=lambda *args: seen.append(args))
+        self.assertEqual(summary['files'], 0)
+        self.assertEqual(summary['rows'], 0)
+        self.assertEqual(sorted(summary['failed'].keys()), ['a.fits', 'b.fits'])
+        self.assertEqual(sorted(args[0] for args in seen), [1, 2])
+
+    @unittest.skipIf(numpy is None, "numpy is not available")
+    def test_datafile_ingest_pipeline(self):
+        metadata = ['TASK', {'TASKS': {'id': {'datatype': 'int', 'format': None, 'columns': ['id']},
+                                       'name': {'datatype': 'char', 'format': None, 'columns': ['name']}}}]
+        pipeline = datafileingest.DatafileIngestPipeline(self.sfile, 'db-test', 'task_table', 'tasks',
+                                                         nworkers=2, chunksize=2, reader=memory_task_reader,
+                                                         filename_column='label', datafile_metadata=metadata)
+        summary = pipeline.run(['file1.xml', 'file2.xml'])
+        self.assertEqual(summary, {'files': 2, 'rows': 10, 'failed': {}})
+
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        curs = dbh.cursor()
+        curs.execute("select name, label, count(*) from task where id >= 900000 group by name, label order by label")
+        self.assertEqual(curs.fetchall(), [('ingested', 'file1.xml', 5), ('ingested', 'file2.xml', 5)])
+        curs.execute("delete from task where id >= 900000")
+        dbh.commit()
+
+    def test_datafile_metadata_cache(self):
+        dbh = dmdbi.DesDmDbi(self.sfile, 'db-test')
+        direct = dbh.get_datafile_metadata('cat_finalcut')
+        cache = dbh.load_datafile_metadata_cache()
+        self.assertTrue('cat_finalcut' in cache)
+        data = dbh.get_datafile_metadata('CAT_FINALCUT')
+        self.assertIs(data, cache['cat_finalcut'])
+        self.assertEqual(data, direct)
+        self.assertRaises(ValueError, dbh.get_datafile_metadata, 'cat_something')
+
+        dbh.clear_datafile_metadata_cache()
+        data = dbh.get_datafile_metadata('cat_finalcut')
+        self.assertIsNot(data, cache['cat_finalcut'])
+        self.assertEqual(data, direct)
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestDatafileRowMapper(unittest.TestCase):
+    metadata = ['SE_OBJECT',
+                {'LDAC_OBJECTS': {'number': {'datatype': 'int', 'format': None, 'columns': ['number']},
+                                  'flux_aper': {'datatype': 'float', 'format': None,
+                                                'columns': ['flux_aper_1', 'flux_aper_2']},
+                                  'name': {'datatype': 'char', 'format': None, 'columns': ['name']}}}]
+
+    def make_data(self, nrows):
+        data = numpy.zeros(nrows, dtype=[('NUMBER', 'i4'), ('FLUX_APER', 'f4', (3,)), ('NAME', 'S5')])
+        data['NUMBER'] = numpy.arange(nrows)
+        data['FLUX_APER'][:, 1] = 7.
+        data['NAME'] = b'ab  '
+        return data
+
+    def test_map_table(self):
+        mapper = datafilemap.DatafileRowMapper(self.metadata, 'ldac_objects')
+        self.assertEqual(mapper.tablename, 'SE_OBJECT')
+        self.assertEqual(mapper.columns, ['number', 'flux_aper_1', 'flux_aper_2', 'name'])
+        columns, arrays = mapper.map_table(self.make_data(4), extra={'filename': 'test.fits'})
+        self.assertEqual(columns[-1], 'filename')
+        self.assertEqual(arrays[0].tolist(), [0, 1, 2, 3])
+        self.assertEqual(arrays[2].tolist(), [7.0] * 4)
+        self.assertEqual(arrays[3].tolist(), ['ab'] * 4)
+        self.assertEqual(arrays[4].tolist(), ['test.fits'] * 4)
+
+        self.assertRaises(ValueError, datafilemap.DatafileRowMapper, self.metadata, 'primary')
+        self.assertRaises(ValueError, mapper.map_table, numpy.zeros(2, dtype=[('NUMBER', 'i4')]))
+
+    def test_empty_table(self):
+        mapper = datafilemap.DatafileRowMapper(self.metadata, 'ldac_objects')
+        columns, arrays = mapper.map_table(self.make_data(0))
+        self.assertEqual(len(columns), 4)
+        self.assertEqual([len(arr) for arr in arrays], [0] * 4)
+        self.assertEqual(list(mapper.iter_batches(self.make_data(0))), [])
+
+    def test_conversion_errors(self):
+        mapper = datafilemap.DatafileRowMapper(self.metadata, 'ldac_objects')
+        data = numpy.zeros(2, dtype=[('NUMBER', 'f8'), ('FLUX_APER', 'f4', (2,)), ('NAME', 'S5')])
+        data['NUMBER'] = [1., 2.]
+        self.assertEqual(mapper.map_table(data)[1][0].tolist(), [1, 2])
+        data['NUMBER'] = [1.5, 2.]
+        self.assertRaises(ValueError, mapper.map_table, data)
+        data['NUMBER'] = [numpy.nan, 2.]
+        self.assertRaises(ValueError, mapper.map_table, data)
+
+        unsigned = numpy.zeros(2, dtype=[('NUMBER', 'u8'), ('FLUX_APER', 'f4', (2,)), ('NAME', 'S5')])
+        unsigned['NUMBER'] = [1, 2]
+        self.assertEqual(mapper.map_table(unsigned)[1][0].tolist(), [1, 2])
+        unsigned['NUMBER'] = [1, 2**63]
+        self.assertRaises(ValueError, mapper.map_table, unsigned)
+
+        text = numpy.zeros(2, dtype=[('NUMBER', 'U4'), ('FLUX_APER', 'U4', (2,)), ('NAME', 'U5')])
+        text['NUMBER'] = ['1', '2']
+        text['FLUX_APER'] = '2.5'
+        self.assertEqual(mapper.map_table(text)[1][1].tolist(), [2.5, 2.5])
+        text['NUMBER'] = ['1', 'x']
+        self.assertRaises(ValueError, mapper.map_table, text)
+
+    def test_iter_batches(self):
+        mapper = datafilemap.DatafileRowMapper(self.metadata, 'LDAC_OBJECTS')
+        batches = list(mapper.iter_batches(self.make_data(5), batchsize=2))
+        self.assertEqual([len(rows) for (_, rows) in batches], [2, 2, 1])
+        self.assertEqual(batches[-1][1][0], (4, 0.0, 7.0, 'ab'))
+
+
+class TestJobFileMvmtResolver(unittest.TestCase):
+    def test_resolve(self):
+        resolver = jobfilemvmt.JobFileMvmtResolver([('site1', None, None, 'mvmt_local'),
+                                                    ('site1', 'home', None, 'mvmt_home')],
+                                                   [('site1', 'home', None, 'extra', 'val')])
+        self.assertEqual(len(resolver), 2)
+        self.assertEqual(resolver.resolve('site1', '', 'no_archive'), {'mvmtclass': 'mvmt_local'})
+        self.assertEqual(resolver.resolve('site1', 'home', None), {'mvmtclass': 'mvmt_home', 'extra': 'val'})
+        self.assertRaises(ValueError, resolver.resolve, 'site2', None, None)
+
+        resolver = jobfilemvmt.JobFileMvmtResolver.from_info({'site1': {'home': {'no_archive': {'mvmtclass': 'mvmt_home'}}}})
+        self.assertEqual(resolver.resolve('site1', 'home', None), {'mvmtclass': 'mvmt_home'})
+
+    def test_validation(self):
+        with self.assertRaises(ValueError) as err:
+            jobfilemvmt.JobFileMvmtResolver([('site1', None, None, 'mvmt')],
+                                            [('site2', None, None, 'key', 'val'),
+                                             ('site1', 'home', None, 'key', 'val')])
+        self.assertTrue('site2' in str(err.exception))
+        self.assertTrue('home' in str(err.exception))
+
+
+class TestArchiveRouter(unittest.TestCase):
+    def test_route(self):
+        router = archiveroute.ArchiveRouter({'arch1': {'arch2': {'transfer': 'xfer12'},
+                                                       'arch3': {'transfer': 'xfer13', 'cost': '5'},
+                                                       'arch1': {'transfer': 'local'}},
+                                             'arch2': {'arch3': {'transfer': 'xfer23'}},
+                                             'arch4': {'arch5': {'other': 'val'}}})
+        self.assertEqual(router.archives, ['arch1', 'arch2', 'arch3'])
+        self.assertEqual(router.route('arch1', 'arch3'), {'path': ['arch1', 'arch2', 'arch3'],
+                                                          'transfers': ['xfer12', 'xfer23'],
+                                                          'cost': 2.0})
+        self.assertEqual(router.route('arch1', 'arch2')['transfers'], ['xfer12'])
+        self.assertEqual(router.route('arch1', 'arch1')['transfers'], ['local'])
+        self.assertFalse(router.has_route('arch3', 'arch1'))
+        self.assertRaises(ValueError, router.route, 'arch4', 'arch5')
+
+    def test_invalid_cost(self):
+        self.assertRaises(ValueError, archiveroute.ArchiveRouter,
+                          {'arch1': {'arch2': {'transfer': 'xfer12', 'cost': 'high'}}})
+        for cost in ['-5', 'nan', 'inf']:
+            self.assertRaises(ValueError, archiveroute.ArchiveRouter,
+                              {'arch1': {'arch2': {'transfer': 'xfer12', 'cost': cost}}})
+
+
+class TestFileIdCache(unittest.TestCase):
+    def test_lru(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = filecache.FileIdCache(os.path.join(tmpdir, 'fileid.db'), maxentries=3)
+            cache.put_many({('a.fits', '.fz'): {'id': 1, 'filesize': 10},
+                            ('b.fits', None): {'id': 2, 'filesize': None}})
+            time.sleep(0.01)
+            hits = cache.get_many([('a.fits', '.fz'), ('b.fits', None), ('c.fits', None)])
+            self.assertEqual(hits, {('a.fits', '.fz'): {'id': 1, 'filesize': 10},
+                                    ('b.fits', None): {'id': 2, 'filesize': None}})
+            time.sleep(0.01)
+            cache.get_many([('a.fits', '.fz')])
+            time.sleep(0.01)
+            cache.put_many({('c.fits', None): {'id': 3, 'filesize': 1},
+                            ('d.fits', None): {'id': 4, 'filesize': 1}})
+            self.assertEqual(len(cache), 3)
+            hits = cache.get_many([('a.fits', '.fz'), ('b.fits', None)])
+            self.assertEqual(list(hits.keys()), [('a.fits', '.fz')])
+            cache.close()
+
+            # persistent
+            cache = filecache.FileIdCache(os.path.join(tmpdir, 'fileid.db'), maxentries=3)
+            self.assertEqual(len(cache), 3)
+            cache.clear()
+            self.assertEqual(len(cache), 0)
+            cache.close()
+
+
+class TestImportTime(unittest.TestCase):
+    # modules usable without a DB connection must not pull in the DB (or other heavy) modules
+    light_modules = ['despydmdb', 'despydmdb.dmdb_defs', 'despydmdb.dbsemaphore', 'despydmdb.jobfilemvmt',
+                     'despydmdb.archiveroute', 'despydmdb.datafilemap', 'despydmdb.metadataingest',
+                     'despydmdb.datafileingest', 'despydmdb.parallelgtt', 'despydmdb.columnar',
+                     'despydmdb.configcache', 'despydmdb.tasktree']
+    optional_modules = ['cx_Oracle', 'numpy', 'pyarrow', 'fitsio', 'multiprocessing', 'sqlite3']
+    heavy_modules = ['despydb', 'despydb.desdbi', 'despydmdb.desdmdbi'] + optional_modules
+    # desdmdbi needs despydb and despymisc, the rest is only imported when used
+    desdmdbi_deps = ['despydb.desdbi', 'despymisc.miscutils']
+    desdmdbi_lazy = optional_modules + ['despydmdb.columnar', 'despydmdb.tasktree', 'despydmdb.archiveroute',
+                                        'despydmdb.jobfilemvmt', 'despydmdb.configcache']
+    # cold import time budgets, as multiples of the cold import time of the json module
+    # measured in the same interpreter, so they don't depend on the machine
+    budget_factor = float(os.environ.get('DESPYDMDB_IMPORT_BUDGET', '3.0'))
+    desdmdbi_budget_factor = float(os.environ.get('DESPYDMDB_DESDMDBI_IMPORT_BUDGET', '2.0'))
+    ntries = 3
+
+    def _import_ratio(self, mod, heavy, preimport=()):
+        """ best of ntries runs of the cold import time of mod relative to json """
+        imports = ', '.join(['json', 'sys'] + list(preimport) + [mod])
+        code = f"import {imports}; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+        ratios = []
+        for _ in range(self.ntries):
+            res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+            self.assertEqual(res.stdout.strip(), '', f"{mod} imports heavy modules")
+
+            cumulative = {}
+            for line in res.stderr.splitlines():
+                fields = line.split('|')
+                if len(fields) == 3 and fields[2].strip() in ('json', mod) and not fields[2][1:].startswith(' '):
+                    cumulative[fields[2].strip()] = int(fields[1])
+            self.assertEqual(sorted(cumulative), sorted({'json', mod}))
+            ratios.append(cumulative[mod] / cumulative['json'])
+        return min(ratios)
+
+    def test_lazy_imports(self):
+        for mod in self.light_modules:
+            ratio = self._import_ratio(mod, self.heavy_modules)
+            self.assertTrue(ratio < self.budget_factor,
+                            f"import of {mod} took {ratio:.2f} times the json import (budget {self.budget_factor})")
+
+    def test_desdmdbi_import(self):
+        # despydb and despymisc are imported first, so only the time added by desdmdbi is measured
+        ratio = self._import_ratio('despydmdb.desdmdbi', self.desdmdbi_lazy, self.desdmdbi_deps)
+        self.assertTrue(ratio < self.desdmdbi_budget_factor,
+                        f"import of despydmdb.desdmdbi took {ratio:.2f} times the json import "
+                        f"(budget {self.desdmdbi_budget_factor})")
+
+    def test_lazy_names(self):
+        code = "import sys, despydmdb; despydmdb.ArchiveRouter; despydmdb.load_config; print('despydmdb.desdmdbi' in sys.modules)"
+        res = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(res.stdout.strip(), 'False')
+        import despydmdb
+        self.assertIs(despydmdb.JobFileMvmtResolver, jobfilemvmt.JobFileMvmtResolver)
+        self.assertRaises(AttributeError, getattr, despydmdb, 'NoSuchName')
+
+
+class TestConfigCache(unittest.TestCase):
+    def test_save_load(self):
+        config = {'site_info': {'descampuscluster': {'gridtype': 'condor', 'login_host': 'h'}},
+                  'archive_info': {'desar2home': {'root': '/archive'}}}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'config.json')
+            configcache.save_config(path, config)
+            self.assertEqual(configcache.load_config(path), config)
+            self.assertEqual(list(configcache.load_config(path, ['archive_info'])), ['archive_info'])
+            self.assertRaises(ValueError, configcache.load_config, path, ['job_file_mvmt_info'])
+            self.assertEqual(os.listdir(tmpdir), ['config.json'])
+
+
+@unittest.skipIf(numpy is None, "numpy is not available")
+class TestColumnar(unittest.TestCase):
+    class DbType:
+        def __init__(self, name):
+            self.name = name
+
+    description = [('ID', DbType('DB_TYPE_NUMBER'), None, None, 22, 0, False),
+                   ('FILENAME', DbType('DB_TYPE_VARCHAR'), None, None, None, None, False),
+                   ('FILESIZE', DbType('DB_TYPE_NUMBER'), None, None, 0, -127, True),
+                   ('MD5SUM', DbType('DB_TYPE_CHAR'), None, None, None, None, True),
+                   ('CREATED_DATE', DbType('DB_TYPE_DATE'), None, None, None, None, True),
+                   ('EXTRA', None, None, None, None, None, True)]
+
+    def test_description_kinds(self):
+        self.assertEqual(columnar.description_kinds(self.description),
+                         ['int', 'str', 'float', 'str', 'datetime', 'object'])
+        self.assertEqual(columnar.description_kinds(self.description, {'filesize': 'int', 'extra': 'str'})[2:],
+                         ['int', 'str', 'datetime', 'str'])
+        self.assertRaises(ValueError, columnar.description_kinds, self.description, {'id': 'long'})
+
+    def test_to_numpy_columns(self):
+        names = ['id', 'filename', 'filesize', 'md5sum']
+        kinds = ['int', 'str', 'float', 'str']
+        cols = columnar.to_numpy_columns(names, kinds, [(1, 'a.fits', 10, None), (2, 'b.fits', None, 'ab66')])
+        self.assertEqual(list(cols.keys()), names)
+        self.assertEqual(cols['id'].dtype, numpy.int64)
+        self.assertEqual(cols['filesize'].dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(cols['filesize'][1]))
+        self.assertEqual(cols['filename'].tolist(), ['a.fits', 'b.fits'])
+        self.assertEqual(cols['md5sum'].tolist(), [None, 'ab66'])
+        self.assertEqual(len(columnar.to_numpy_columns(['id'], ['int'], [])['id']), 0)
+
+        # the types don't depend on the values of a batch
+        cols = columnar.to_numpy_columns(names, kinds, [(None, 'c.fits', 10, None)])
+        self.assertEqual(cols['id'].dtype, numpy.int64)
+        self.assertTrue(cols['id'].mask[0])
+        self.assertEqual(cols['filesize'].dtype, numpy.float64)
+        self.assertEqual(columnar.to_numpy_columns(['size'], ['float'], [(1,), (2.5,)])['size'].tolist(), [1.0, 2.5])
+        self.assertRaises(ValueError, columnar.to_numpy_columns, ['id'], ['int'], [(1,), (2.5,)])
+        dates = columnar.to_numpy_columns(['created_date'], ['datetime'], [(None,)])['created_date']
+        self.assertEqual(dates.dtype, numpy.dtype('datetime64[us]'))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not available")
+    def test_to_arrow_batch(self):
+        schema = columnar.arrow_schema(['id', 'filesize'], ['int', 'float'])
+        batch = columnar.to_arrow_batch(schema, [(1, None), (2, 3)])
+        self.assertEqual(batch.num_rows, 2)
+        self.assertEqual(batch.column(1).null_count, 1)
+        self.assertEqual(columnar.to_arrow_batch(schema, [(None, 1)]).schema, batch.schema)
+        self.assertRaises(ValueError, columnar.to_arrow_batch, schema, [(2.5, 1)])
+        self.assertRaises(ValueError, columnar.arrow_schema, ['extra'], ['object'])
+
+
+class RecordingDbh:
+    def __init__(self):
+        self.inserts = []
+
+    def insert_many(self, table, columns, rows):
+        self.inserts.append((table, columns, list(rows)))
+
+
+class TestHeaderMetadataIngester(unittest.TestCase):
+    ftmeta = {'raw': {'hdus': {'primary': {'r': {'h': {'expnum': 'expnum', 'filename': 'filename'}},
+                                           'o': {'h': {'band': 'band'}}}},
+                      'metadata_table': 'exposure'},
+              'red': {'hdus': {'primary': {'r': {'h': {'filename': 'filename'}}}}}}
+
+    def test_batching(self):
+        dbh = RecordingDbh()
+        ingester = metadataingest.HeaderMetadataIngester(dbh, self.ftmeta, batchsize=3)
+        ingester.add('RAW', {'PRIMARY': {'EXPNUM': 1, 'FILENAME': 'a.fits'}})
+        ingester.add_many([('raw', {'primary': {'expnum': 2, 'filename': 'b.fits', 'band': 'g'}})])
+        self.assertEqual(dbh.inserts, [])
+        ingester.add('raw', {'primary': {'expnum': 3, 'filename': 'c.fits'}})
+        self.assertEqual(len(dbh.inserts), 1)
+        self.assertEqual(dbh.inserts[0][0], 'exposure')
+        self.assertEqual(dbh.inserts[0][1], ['expnum', 'filename', 'band'])
+        self.assertEqual(dbh.inserts[0][2][1], [2, 'b.fits', 'g'])
+        self.assertEqual(ingester.flush(), 0)
+        self.assertEqual(ingester.ninserted, 3)
+
+    def test_errors(self):
+        ingester = metadataingest.HeaderMetadataIngester(RecordingDbh(), self.ftmeta)
+        self.assertRaises(ValueError, ingester.add, 'raw', {'primary': {'filename': 'd.fits'}})
+        self.assertRaises(ValueError, ingester.add, 'red', {'primary': {'filename': 'd.fits'}})
+        self.assertRaises(ValueError, ingester.add, 'bad', {})
+
+
 if __name__ == '__main__':
     unittest.main()